@@ -15,8 +15,11 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 from ESP32_pca9685fb import PCA9685
-import math    # Only needed for math.sin. Can be precomputed if math module is not available
+import array
+import micropython
+from micropython import const
 import utime
+import uasyncio as asyncio
 
 class DCMotor:
   """
@@ -24,12 +27,10 @@ class DCMotor:
   labelled M1, M2, M3 and M4 on the shield.
   """
   # Channels of the PCA9685 that are driving the motor ports M1, M2, M3 and M4
-  _MOTORS = (
-    {'pwm':8,  'in1':10,  'in2': 9}, # Motor 1
-    {'pwm':13, 'in1':11, 'in2': 12}, # Motor 2
-    {'pwm':2,  'in1':4,  'in2': 3},  # Motor 3
-    {'pwm':7,  'in1':5,  'in2': 6}   # Motor 4
-  )
+  #              M1  M2  M3  M4
+  _MOTORS_PWM = ( 8, 13,  2,  7)
+  _MOTORS_IN1 = (10, 11,  4,  5)
+  _MOTORS_IN2 = ( 9, 12,  3,  6)
 
   def __init__(self, pca, motor):
     """
@@ -38,10 +39,23 @@ class DCMotor:
     self._pca = pca
     if (motor < 1) or (motor > 4):
       raise ValueError('Invalid motor number (1-4)')
-    self._pwm = DCMotor._MOTORS[motor-1]['pwm']
-    self._in1 = DCMotor._MOTORS[motor-1]['in1']
-    self._in2 = DCMotor._MOTORS[motor-1]['in2']
+    self._pwm = DCMotor._MOTORS_PWM[motor-1]
+    self._in1 = DCMotor._MOTORS_IN1[motor-1]
+    self._in2 = DCMotor._MOTORS_IN2[motor-1]
+    # The three channels of a motor port are consecutive, so they are
+    # updated with one setDutyBlock call on the duty cycles in '_rates'.
+    self._first = min(self._pwm, self._in1, self._in2)
+    self._rates = [0, 0, 0]
   
+  def _setLines(self, pwm, in1, in2):
+    """ Set the duty cycles of the PWM, IN1 and IN2 lines in one I2C transfer. """
+    rates = self._rates
+    first = self._first
+    rates[self._pwm - first] = pwm
+    rates[self._in1 - first] = in1
+    rates[self._in2 - first] = in2
+    self._pca.setDutyBlock(first, rates)
+
   def throttle(self, th): # th is -4096..4096
     """
     Set the throttle of this motor to 'th'.
@@ -51,25 +65,18 @@ class DCMotor:
       4096: the motor is at max speed.
     """
     if th > 0: # Forward
-      self._pca.setDuty(self._in2, 0)
-      self._pca.setDuty(self._in1, 4096)
+      self._setLines(th, 4096, 0)
     elif th == 0:
-      self._pca.setDuty(self._in2, 0)
-      self._pca.setDuty(self._in1, 0)
+      self._setLines(0, 0, 0)
     else:
-      self._pca.setDuty(self._in1, 0)
-      self._pca.setDuty(self._in2, 4096)
-      th = -th
-    self._pca.setDuty(self._pwm, th)
+      self._setLines(-th, 0, 4096)
 
   def brake(self):
     """
     Make the motor stop by setting the PWM to 0 while maintaining the voltage.
     This stops the motor more quickly than juste setting the throttle to 0.
     """
-    self._pca.setDuty(self._in1, 4096)
-    self._pca.setDuty(self._in2, 4096)
-    self._pca.setDuty(self._pwm, 0)
+    self._setLines(0, 4096, 4096)
 
 """ Example
 pca = pca9685fb.PCA9685(1)
@@ -78,19 +85,62 @@ m1 = DCMotor(pca, 1)
 m1.throttle(2000)
 """
 
-# Number of micro steps in one step
-MICROSTEPS = 16
+# Number of micro steps in one step (must be a power of two)
+MICROSTEPS = const(16)
+# Mask keeping a micro-step phase in [0..4*MICROSTEPS-1]
+_UPHASE_MASK = const(4 * MICROSTEPS - 1)
+
+@micropython.native
+def _pace(deadline, period):
+  """
+  Wait until 'period' microseconds after 'deadline' (a utime.ticks_us() value)
+  and return the new deadline. Whole milliseconds are slept, the rest is
+  busy-waited so that steps keep a steady cadence whatever the time spent
+  driving the motor. When already late, the cadence restarts from now
+  instead of issuing a burst of steps to catch up.
+  """
+  ticks_us = utime.ticks_us
+  ticks_diff = utime.ticks_diff
+  deadline = utime.ticks_add(deadline, period)
+  remaining = ticks_diff(deadline, ticks_us())
+  if remaining < 0:
+    return ticks_us()
+  if remaining > 1500:
+    utime.sleep_ms(remaining // 1000)
+  while ticks_diff(deadline, ticks_us()) > 0:
+    pass
+  return deadline
+
+async def _paceAsync(deadline, period):
+  """
+  Same as _pace, but let other asyncio tasks run while sleeping.
+  The event loop is given a chance to run other tasks at each call, even for
+  short periods, and only the time that remains after that is busy-waited.
+  """
+  deadline = utime.ticks_add(deadline, period)
+  remaining = utime.ticks_diff(deadline, utime.ticks_us())
+  if remaining < 0:
+    await asyncio.sleep_ms(0)
+    return utime.ticks_us()
+  if remaining > 1500:
+    await asyncio.sleep_ms(remaining // 1000)
+  else:
+    await asyncio.sleep_ms(0)
+  ticks_us = utime.ticks_us
+  ticks_diff = utime.ticks_diff
+  while ticks_diff(deadline, ticks_us()) > 0:
+    pass
+  return deadline
 
 class Stepper:
   """
   A stepper motor: stepper 1 is plugged on motors M1 and M2, 
   stepper 2 is plugged on motors M3 and M4
   """
-  # Motor ports used for each of the two possible stepper motors
-  _STEPPERS = (
-    {'a': DCMotor._MOTORS[0], 'b': DCMotor._MOTORS[1]}, # Stepper 1
-    {'a': DCMotor._MOTORS[2], 'b': DCMotor._MOTORS[3]}  # Stepper 2
-  )
+  # Motor ports used for each of the two possible stepper motors:
+  # stepper n uses port _STEPPERS_A[n-1] for coil A and _STEPPERS_B[n-1] for coil B
+  _STEPPERS_A = (0, 2)   # M1, M3
+  _STEPPERS_B = (1, 3)   # M2, M4
 
   # Coil driving phases for steper motors:
   # Even phases drive only one coil.
@@ -106,8 +156,30 @@ class Stepper:
     0b1001  
   ])
 
-  # Coil drive sine computed for one quadrant ([0, π/2])
-  _DRIVESINE = tuple(round(4096*math.sin(i/MICROSTEPS*math.pi/2)) for i in range(MICROSTEPS+1))
+  # Duty of the four drive lines for each phase
+  _DRIVE_DUTIES = tuple(tuple(4096 * ((p >> i) & 1) for i in range(4)) for p in _PHASES)
+
+  # Coil drive sine for one quadrant ([0, π/2]), precomputed for MICROSTEPS = 16 as
+  # tuple(round(4096*math.sin(i/MICROSTEPS*math.pi/2)) for i in range(MICROSTEPS+1))
+  _DRIVESINE = (0, 401, 799, 1189, 1567, 1931, 2276, 2598, 2896,
+                3166, 3406, 3612, 3784, 3920, 4017, 4076, 4096)
+
+  # Power of coil A, power of coil B and coil driving phase for each micro-step phase,
+  # flattened as 3 consecutive uint16 per micro-step phase
+  _MICROTAB = array.array('H')
+  for ph in range(4 * MICROSTEPS):
+    q = ph // MICROSTEPS
+    if (q % 2) == 0:
+      a = (q + 1) * MICROSTEPS - ph
+      b = ph - q * MICROSTEPS
+    else:
+      a = ph - q * MICROSTEPS
+      b = (q + 1) * MICROSTEPS - ph
+    _MICROTAB.append(_DRIVESINE[a])
+    _MICROTAB.append(_DRIVESINE[b])
+    _MICROTAB.append(2 * q + 1)
+  # The sine table is only needed to build _MICROTAB
+  del ph, q, a, b, _DRIVESINE
 
   def __init__(self, pca, stepper):
     """
@@ -116,21 +188,51 @@ class Stepper:
     self._pca = pca
     if (stepper < 1) or (stepper > 2):
       raise ValueError('Invalid stepper number (1-2)')
-    self._pwma = Stepper._STEPPERS[stepper-1]['a']['pwm']
-    self._ain1 = Stepper._STEPPERS[stepper-1]['a']['in1']
-    self._ain2 = Stepper._STEPPERS[stepper-1]['a']['in2']
-    self._pwmb = Stepper._STEPPERS[stepper-1]['b']['pwm']
-    self._bin1 = Stepper._STEPPERS[stepper-1]['b']['in1']
-    self._bin2 = Stepper._STEPPERS[stepper-1]['b']['in2']
+    a = Stepper._STEPPERS_A[stepper-1]
+    b = Stepper._STEPPERS_B[stepper-1]
+    self._pwma = DCMotor._MOTORS_PWM[a]
+    self._ain1 = DCMotor._MOTORS_IN1[a]
+    self._ain2 = DCMotor._MOTORS_IN2[a]
+    self._pwmb = DCMotor._MOTORS_PWM[b]
+    self._bin1 = DCMotor._MOTORS_IN1[b]
+    self._bin2 = DCMotor._MOTORS_IN2[b]
     self._drive = [0,0,0,0]
     self._drive[0] = self._ain2
     self._drive[1] = self._bin1
     self._drive[2] = self._ain1
     self._drive[3] = self._bin2
+    # The six channels of a stepper are consecutive on the shield,
+    # so they are all updated with one call to setDutyBlock with the
+    # duty cycles in 'self._rates', in which each channel has a slot
+    # relative to the first channel.
+    channels = (self._pwma, self._ain1, self._ain2, self._pwmb, self._bin1, self._bin2)
+    self._first = min(channels)
+    self._rates = [0] * (max(channels) - self._first + 1)
+    self._slota = self._pwma - self._first
+    self._slotb = self._pwmb - self._first
+    self._driveslots = [ch - self._first for ch in self._drive]
     self._phase = 0
     self._currentstep = 0
     self.power()
   
+  @micropython.native
+  def _setLines(self, power_a, power_b, phase):
+    """
+    Set the PWM of coils A and B to 'power_a' and 'power_b', and set the
+    drive lines for coil driving phase 'phase', in one I2C transfer.
+    """
+    rates = self._rates
+    slots = self._driveslots
+    d = Stepper._DRIVE_DUTIES[phase]
+    rates[self._slota] = power_a
+    rates[self._slotb] = power_b
+    rates[slots[0]] = d[0]
+    rates[slots[1]] = d[1]
+    rates[slots[2]] = d[2]
+    rates[slots[3]] = d[3]
+    # Only the channels that changed are sent
+    self._pca.setDutyBlock(self._first, rates)
+
   def power(self):
     """ Power the PWM lines of the driver. """
     self._pca.setDuty(self._pwma, 4096)
@@ -146,10 +248,59 @@ class Stepper:
     self._pca.setDuty(self._bin2, 0)
     self._phase = 0
   
-  def waveStep(self, n, delay=20):
+  @micropython.native
+  def _waveOne(self, step):
+    """ Perform one step in wave drive mode in direction 'step' (1 or -1). """
+    # In single step mode, the phase is always even (one coil at a time)
+    phase = self._phase
+    if phase % 2 != 0 :
+      phase += step
+    else:
+      phase += 2 * step
+    # Keep the phase in [0..7]
+    phase &= 7
+    self._phase = phase
+    # Set motor drive lines.
+    self._setLines(4096, 4096, phase)
+
+  @micropython.native
+  def _fullOne(self, step):
+    """ Perform one step in full drive mode in direction 'step' (1 or -1). """
+    # In double step mode, the phase is always odd (two coils at a time)
+    phase = self._phase
+    if phase % 2 == 0 :
+      phase += step
+    else:
+      phase += 2 * step
+    # Keep the phase in [0..7]
+    phase &= 7
+    self._phase = phase
+    # Set motor drive lines.
+    self._setLines(4096, 4096, phase)
+
+  @micropython.native
+  def _halfOne(self, step):
+    """ Perform one step in half-step drive mode in direction 'step' (1 or -1). """
+    # Keep the phase in [0..7]
+    phase = (self._phase + step) & 7
+    self._phase = phase
+    # Set motor drive lines.
+    self._setLines(4096, 4096, phase)
+
+  @micropython.native
+  def _microOne(self, step):
+    """ Perform one step in micro-step drive mode in direction 'step' (1 or -1). """
+    uphase = (self._phase + step) & _UPHASE_MASK
+    self._phase = uphase
+    tab = Stepper._MICROTAB
+    i = 3 * uphase
+    # Set motor drive lines.
+    self._setLines(tab[i], tab[i+1], tab[i+2])
+
+  @micropython.native
+  def _run(self, one, n, delay):
     """
-    Perform n steps in wave drive mode (one coil at a time), 
-    waiting delay milliseconds between each step.
+    Perform n steps with 'one', waiting delay milliseconds between each step.
     A negative number of steps turn in the other direction.
     """
     if n == 0:
@@ -158,29 +309,16 @@ class Stepper:
     if n < 0:
       step = -1
       n = -n
+    pace = _pace
+    period = delay * 1000
+    deadline = utime.ticks_us()
     for i in range(n):
-      # In single step mode, the phase is always even (one coil at a time)
-      if self._phase % 2 != 0 :
-        self._phase += step
-      else:
-        self._phase += 2 * step
-      # Keep the phase in [0..7]
-      while self._phase < 0:
-        self._phase += 8
-      while self._phase > 7:
-        self._phase -= 8
-      # Set motor drive lines.
-      self._pca.setDuty(self._pwma, 4096)
-      self._pca.setDuty(self._pwmb, 4096)
-      for i in range(4):
-        self._pca.setDuty(self._drive[i], 4096 * ((Stepper._PHASES[self._phase] >> i) & 1))
-      utime.sleep_ms(delay)
-    
-  def fullStep(self, n, delay=10):
+      one(step)
+      deadline = pace(deadline, period)
+
+  async def _runAsync(self, one, n, delay):
     """
-    Perform n steps in full drive mode (two coils at a time),
-    waiting delay milliseconds between each step.
-    A negative number of steps turn in the other direction.
+    Same as _run, but let other asyncio tasks run while waiting between steps.
     """
     if n == 0:
       return
@@ -188,23 +326,35 @@ class Stepper:
     if n < 0:
       step = -1
       n = -n
+    period = delay * 1000
+    deadline = utime.ticks_us()
     for i in range(n):
-      # In double step mode, the phase is always odd (two coils at a time)
-      if self._phase % 2 == 0 :
-        self._phase += step
-      else:
-        self._phase += 2 * step
-      # Keep the phase in [0..7]
-      while self._phase < 0:
-        self._phase += 8
-      while self._phase >= 8:
-        self._phase -= 8
-      # Set motor drive lines.
-      self._pca.setDuty(self._pwma, 4096)
-      self._pca.setDuty(self._pwmb, 4096)
-      for i in range(4):
-        self._pca.setDuty(self._drive[i], 4096 * ((Stepper._PHASES[self._phase] >> i) & 1))
-      utime.sleep_ms(delay)
+      one(step)
+      deadline = await _paceAsync(deadline, period)
+
+  def waveStep(self, n, delay=20):
+    """
+    Perform n steps in wave drive mode (one coil at a time), 
+    waiting delay milliseconds between each step.
+    A negative number of steps turn in the other direction.
+    """
+    self._run(self._waveOne, n, delay)
+
+  async def waveStepAsync(self, n, delay=20):
+    """ Coroutine version of waveStep. """
+    await self._runAsync(self._waveOne, n, delay)
+    
+  def fullStep(self, n, delay=10):
+    """
+    Perform n steps in full drive mode (two coils at a time),
+    waiting delay milliseconds between each step.
+    A negative number of steps turn in the other direction.
+    """
+    self._run(self._fullOne, n, delay)
+
+  async def fullStepAsync(self, n, delay=10):
+    """ Coroutine version of fullStep. """
+    await self._runAsync(self._fullOne, n, delay)
     
   def halfStep(self, n, delay=10):
     """
@@ -213,25 +363,11 @@ class Stepper:
     A negative number of steps turn in the other direction.
     This takes twice as many steps as wave and full steps to perform a revolution.
     """
-    if n == 0:
-      return
-    step = 1
-    if n < 0:
-      step = -1
-      n = -n
-    for i in range(n):
-      self._phase += step
-      # Keep the phase in [0..7]
-      while self._phase < 0:
-        self._phase += 8
-      while self._phase >= 8:
-        self._phase -= 8
-      # Set motor drive lines.
-      self._pca.setDuty(self._pwma, 4096)
-      self._pca.setDuty(self._pwmb, 4096)
-      for i in range(4):
-        self._pca.setDuty(self._drive[i], 4096 * ((Stepper._PHASES[self._phase] >> i) & 1))
-      utime.sleep_ms(delay)
+    self._run(self._halfOne, n, delay)
+
+  async def halfStepAsync(self, n, delay=10):
+    """ Coroutine version of halfStep. """
+    await self._runAsync(self._halfOne, n, delay)
     
   def microStep(self, n, delay=1):
     """
@@ -240,31 +376,11 @@ class Stepper:
     A negative number of steps turn in the other direction.
     This takes MICROSTEPS times as many steps as wave and full steps to perform a revolution.
     """
-    if n == 0:
-      return
-    step = 1
-    if n < 0:
-      step = -1
-      n = -n
-    for i in range(n):
-      self._phase += step
-      while self._phase < 0:
-        self._phase += 4 * MICROSTEPS
-      while self._phase >= 4 * MICROSTEPS:
-        self._phase -= 4 * MICROSTEPS
-      quadrant = self._phase // MICROSTEPS
-      if (quadrant % 2) == 0 :
-        power_a = Stepper._DRIVESINE[(quadrant + 1) * MICROSTEPS - self._phase]
-        power_b = Stepper._DRIVESINE[self._phase - (quadrant * MICROSTEPS)]
-      else:
-        power_a = Stepper._DRIVESINE[self._phase - (quadrant * MICROSTEPS)]
-        power_b = Stepper._DRIVESINE[(quadrant + 1) * MICROSTEPS - self._phase]
-      # Set motor drive lines.
-      self._pca.setDuty(self._pwma, power_a)
-      self._pca.setDuty(self._pwmb, power_b)
-      for i in range(4):
-        self._pca.setDuty(self._drive[i], 4096 * ((Stepper._PHASES[2*quadrant+1] >> i) & 1))
-      utime.sleep_ms(delay)
+    self._run(self._microOne, n, delay)
+
+  async def microStepAsync(self, n, delay=1):
+    """ Coroutine version of microStep. """
+    await self._runAsync(self._microOne, n, delay)
   
 """ Example
 pca = PCA9685.PCA9685(1)
@@ -275,6 +391,13 @@ s.microStep(-200*adamotshv2fb.MICROSTEPS)
 s.release()
 """
 
+""" Example with two steppers running concurrently
+import uasyncio as asyncio
+s1 = Stepper(pca, 1)
+s2 = Stepper(pca, 2)
+asyncio.run(asyncio.gather(s1.fullStepAsync(200), s2.microStepAsync(-200*MICROSTEPS)))
+"""
+
 class Servo:
   """
   A servo motor connected to one of the 4 remaining PWM output of the shield.
@@ -297,12 +420,14 @@ class Servo:
     self._range = range
     pca.setDuty(self._pwm, 0) # release the servo
     self._period = 1e6 / pca.getFreq()
-    self._minduty = int(self._minus / (self._period / 4096))
-    self._maxduty = int(self._maxus / (self._period / 4096))
+    self._scale = 4096.0 / self._period  # duty per microsecond
+    self._minduty = int(self._minus * self._scale)
+    self._maxduty = int(self._maxus * self._scale)
+    self._dutyperdegree = (self._maxduty - self._minduty) / range
   
   def setDutyTime(self, us):
     """ Set the duty time of the servo in microseconds. """
-    self._pca.setDuty(self._pwm, int(us / (self._period / 4096)))
+    self._pca.setDuty(self._pwm, int(us * self._scale))
   
   def release(self):
     """ Release the servo (set PWM to 0). """
@@ -310,4 +435,4 @@ class Servo:
   
   def position(self, degrees):
     """ Set the position of the servo in degrees. """
-    self._pca.setDuty(self._pwm, int(self._minduty + (self._maxduty - self._minduty) * (degrees / self._range)))
+    self._pca.setDuty(self._pwm, int(self._minduty + self._dutyperdegree * degrees))
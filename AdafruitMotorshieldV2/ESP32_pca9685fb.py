@@ -7,7 +7,16 @@
 ############
 import machine
 import utime
-import sys
+from micropython import const
+
+# Set to 1 to check the arguments of setPWM and setDuty (slower)
+_DEBUG = const(0)
+
+# Use the native module (see natmod/) for setDuty if it is installed
+try:
+  from pca9685_native import set_duty as _native_set_duty
+except ImportError:
+  _native_set_duty = None
 
 class PCA9685:
   # PCA9685 registers
@@ -22,11 +31,9 @@ class PCA9685:
   ALL_OFF_L = 252   # All LEDs off time LSB
   ALL_OFF_H = 253   # All LEDs off time MSB
   
-  # Individual LEDs registers 0..15, LED 16 is all LEDs """
-  LED_ON_L  = tuple(range(6,67,4))+(ALL_ON_L,) # LSB of the ON counter for LEDS 0..15
-  LED_ON_H  = tuple(range(7,68,4))+(ALL_ON_H,) # MSB of the ON counter for LEDS 0..15
-  LED_OFF_L = tuple(range(8,69,4))+(ALL_OFF_L,) # LSB of the OFF counter for LEDS 0..15
-  LED_OFF_H = tuple(range(9,70,4))+(ALL_OFF_H,) # MSB of the OFF counter for LEDS 0..15
+  # Individual LEDs registers 0..15 start at LED0_ON_L, 4 registers per LED
+  # (ON_L, ON_H, OFF_L, OFF_H), LED 16 is all LEDs (see _ledBase)
+  LED0_ON_L = 6     # LSB of the ON counter for LED 0
   PRESC_REG = 254   # Prescale register
   TEST_REG  = 255   # Test mode register
 
@@ -60,6 +67,16 @@ class PCA9685:
     self._i2c = machine.I2C(scl=machine.Pin(scl), sda=machine.Pin(sda))
     self._address = address
     self.buf = bytearray(1) # one-byte buffer for I2C communications
+    self._buf4 = bytearray(4) # buffer for the 4 registers of an LED
+    self._block = bytearray(64) # buffer for the registers of the 16 LEDs
+    self._blockview = memoryview(self._block) # to send parts of _block without copy
+    # Last duty cycle written to each LED, -1 when unknown.
+    # Used to skip writes that would not change anything.
+    self._duty = [-1] * 16
+    # Last value written to MODE1 (without the RESTART bit), None when unknown
+    self._mode1 = None
+    # PWM frequency, None when unknown
+    self._freq = None
 
   def _write(self, data, register):
     """ Write one byte in a register """
@@ -84,20 +101,44 @@ class PCA9685:
     r = self._read(register)
     return (r[0] & bit) != 0
 
-  def _setTwoBytes(self, value, low_reg, high_reg):
-    """ Write a two byte value in a pair of registers """
-    val = value.to_bytes(2, 'little')
-    self.buf[0] = val[0]
-    self._write(self.buf, low_reg)
-    self.buf[0] = val[1]
-    self._write(self.buf, high_reg)
-  
-  def _getTwoBytes(self, low_reg, high_reg):
-    """ Read a two byte value from a pair of registers """
-    l = self._read(low_reg)
-    h = self._read(high_reg)
-    return 256 * h[0] + l[0]
-  
+  def _readMode1(self):
+    """ Read MODE1, which also refreshes its shadow value """
+    m = self._read(PCA9685.MODE1_REG)[0]
+    self._mode1 = m & ~PCA9685.RESTART
+    return m
+
+  def _getMode1(self):
+    """ Get the shadow value of MODE1, reading it only if unknown """
+    if self._mode1 is None:
+      self._readMode1()
+    return self._mode1
+
+  def _writeMode1(self, mode):
+    """
+    Write MODE1 and remember its value. The RESTART bit is never written
+    here since writing 1 to it restarts the PWM channels (see restart).
+    """
+    self._mode1 = mode & ~PCA9685.RESTART
+    self.buf[0] = self._mode1
+    self._write(self.buf, PCA9685.MODE1_REG)
+
+  def _allOff(self):
+    """ Turn all LEDs off (the ALL_LED registers always read as 0) """
+    self.buf[0] = PCA9685.LED_OFF
+    self._write(self.buf, PCA9685.ALL_OFF_H)
+    self._forgetDuties()
+
+  @staticmethod
+  def _ledBase(led):
+    """ Address of the ON_L register of an LED (LED 16 is all LEDs) """
+    return PCA9685.ALL_ON_L if led == 16 else PCA9685.LED0_ON_L + (led << 2)
+
+  def _forgetDuties(self):
+    """ Forget the last duty cycles written, e.g. when all LEDs are changed """
+    duty = self._duty
+    for i in range(16):
+      duty[i] = -1
+
   def _checkLED(self, led):
     """ Check the validity of an LED number (LED 16 is all LEDs) """
     if ((led < 0) or (led > 16)):
@@ -111,14 +152,16 @@ class PCA9685:
   def enableAllCall(self, enable = True):
     """ Enable the Call All address """
     if (enable):
-      self._setBit(PCA9685.ALLCALL, PCA9685.MODE1_REG)
+      self._writeMode1(self._getMode1() | PCA9685.ALLCALL)
     else:
-      self._clearBit(PCA9685.ALLCALL, PCA9685.MODE1_REG)
+      self._writeMode1(self._getMode1() & ~PCA9685.ALLCALL)
 
   def getFreq(self):
     """ Get the PWM frequency """
-    prescale = self._read(PCA9685.PRESC_REG)[0]
-    return 25e6/(4096*(prescale + 1.0))
+    if self._freq is None:
+      prescale = self._read(PCA9685.PRESC_REG)[0]
+      self._freq = 25e6/(4096*(prescale + 1.0))
+    return self._freq
       
   def setFreq(self, freq):
     """ Set the PWM frequency from 24Hz to 1526Hz """
@@ -128,22 +171,28 @@ class PCA9685:
     if (prescale > 255):
       prescale = 255
     self.sleep()
-    self._write(prescale.to_bytes(1, sys.byteorder), PCA9685.PRESC_REG)
+    self.buf[0] = prescale
+    self._write(self.buf, PCA9685.PRESC_REG)
+    self._freq = 25e6/(4096*(prescale + 1.0))
     self.restart()
       
   def start(self):
     """ Start the internal clock. """
     # Make sure everything is off
-    self._setBit(PCA9685.LED_OFF, PCA9685.ALL_OFF_H)
-    # Start the internal clock
-    self._clearBit(PCA9685.SLEEP, PCA9685.MODE1_REG)
+    self._allOff()
+    m = self._readMode1()
+    # Enable register auto-increment for setPWM and setPWMBlock
+    # and start the internal clock
+    self._writeMode1((m | PCA9685.AUTOINC) & ~PCA9685.SLEEP)
     # Reset the RESTART bit if is was set
-    if (self._testBit(PCA9685.RESTART, PCA9685.MODE1_REG)):
-      self._setBit(PCA9685.RESTART, PCA9685.MODE1_REG)
+    if (m & PCA9685.RESTART):
+      utime.sleep_ms(1)  # wait for the oscillator (minimum is 500µs)
+      self.buf[0] = self._mode1 | PCA9685.RESTART
+      self._write(self.buf, PCA9685.MODE1_REG)
 
   def stop(self):
     """ Stop all PWM channels and stop the internal clock. """
-    self._setBit(PCA9685.LED_OFF, PCA9685.ALL_OFF_H)
+    self._allOff()
     self.sleep()
 
   def sleep(self):
@@ -152,21 +201,23 @@ class PCA9685:
     channels are not stopped. In this case, using restart() will restore
     all PWM settings.
     """
-    self._setBit(PCA9685.SLEEP, PCA9685.MODE1_REG)
+    self._writeMode1(self._getMode1() | PCA9685.SLEEP)
 
   def restart(self):
     """
     Restart the internal clock, preserving all PWM settings after
     sleep has been called while some PWM channels were active.
     """
-    m = self._read(PCA9685.MODE1_REG)
-    if (not self._testBit(PCA9685.RESTART, PCA9685.MODE1_REG)):
+    # The RESTART bit is set by the chip, so MODE1 has to be read
+    m = self._readMode1()
+    if (not (m & PCA9685.RESTART)):
       # If the RESTART bit is not set, there is nothing to do
       return
-    self._clearBit(PCA9685.SLEEP, PCA9685.MODE1_REG)
+    self._writeMode1(m & ~PCA9685.SLEEP)
     utime.sleep_ms(1)  # wait 1ms (minimum is 500µs)
     # Set bit RESTART to 1 to clear it and restart the PWM channels
-    self._setBit(PCA9685.RESTART, PCA9685.MODE1_REG)
+    self.buf[0] = self._mode1 | PCA9685.RESTART
+    self._write(self.buf, PCA9685.MODE1_REG)
 
   def reset(self):
     """
@@ -175,20 +226,106 @@ class PCA9685:
     """
     self.buf[0] = 6
     self._i2c.writeto(0x00, self.buf)
+    self._forgetDuties()
+    self._mode1 = None
+    self._freq = None
   
   def setPWM(self, led, on, off):
-    """ Set the PWM on and off times for an LED """
-    self._checkLED(led)
-    self._checkLengthValue(on)
-    self._checkLengthValue(off)
-    self._setTwoBytes(on, PCA9685.LED_ON_L[led], PCA9685.LED_ON_H[led])
-    self._setTwoBytes(off, PCA9685.LED_OFF_L[led], PCA9685.LED_OFF_H[led])
+    """
+    Set the PWM on and off times for an LED.
+    This relies on register auto-increment, which is enabled by start().
+    The arguments are checked only when _DEBUG is set.
+    """
+    if _DEBUG:
+      self._checkLED(led)
+      self._checkLengthValue(on)
+      self._checkLengthValue(off)
+    # Write ON_L, ON_H, OFF_L and OFF_H at once using register auto-increment
+    b = self._buf4
+    b[0] = on & 0xFF
+    b[1] = on >> 8
+    b[2] = off & 0xFF
+    b[3] = off >> 8
+    self._i2c.writeto_mem(self._address, PCA9685._ledBase(led), b)
+    if led == 16:
+      self._forgetDuties()
+    elif led >= 0:
+      self._duty[led] = -1
   
+  def setPWMBlock(self, first_led, data):
+    """
+    Set the PWM on and off times of consecutive LEDs in one I2C transfer.
+    'data' holds 4 bytes per LED (ON_L, ON_H, OFF_L, OFF_H), starting
+    with LED 'first_led'. Use packDuty to fill it.
+    This relies on register auto-increment, which is enabled by start().
+    """
+    if (first_led < 0) or (first_led + len(data) // 4 > 16):
+      raise ValueError('Invalid LED range')
+    self._i2c.writeto_mem(self._address, PCA9685._ledBase(first_led), data)
+    duty = self._duty
+    for led in range(first_led, first_led + len(data) // 4):
+      duty[led] = -1
+
+  def setDutyBlock(self, first_led, rates):
+    """
+    Set the duty cycles of consecutive LEDs, starting with LED 'first_led',
+    with the same meaning as in setDuty. Only the LEDs from the first to the
+    last one whose duty cycle changed are written, in one I2C transfer.
+    This relies on register auto-increment, which is enabled by start().
+    """
+    duty = self._duty
+    data = self._block
+    pack = PCA9685.packDuty
+    lo = -1
+    hi = -1
+    led = first_led
+    for rate in rates:
+      if (rate < 0):
+        rate = 0
+      if (rate > 4096):
+        rate = 4096
+      if duty[led] != rate:
+        duty[led] = rate
+        if lo < 0:
+          lo = led
+        hi = led
+      led += 1
+    if lo >= 0:
+      # Pack all the slots that are sent, the unchanged ones may have been
+      # set since the last block write by setDuty or setPWM
+      for led in range(lo, hi + 1):
+        pack(data, led, duty[led])
+      self._i2c.writeto_mem(self._address, PCA9685._ledBase(lo), self._blockview[4*lo:4*hi+4])
+
+  @staticmethod
+  def packDuty(data, slot, rate):
+    """
+    Store in 'data' the register values of slot number 'slot' for a duty
+    cycle 'rate', with the same meaning as in setDuty.
+    """
+    i = 4 * slot
+    if (rate <= 0):
+      data[i] = 0
+      data[i+1] = 0
+      data[i+2] = 0
+      data[i+3] = 0x10  # LED_OFF
+    elif (rate >= 4096):
+      data[i] = 0
+      data[i+1] = 0x10  # LED_ON
+      data[i+2] = 0
+      data[i+3] = 0
+    else:
+      data[i] = 0
+      data[i+1] = 0
+      data[i+2] = rate & 0xFF
+      data[i+3] = rate >> 8
+
   def getPWM(self, led):
     """ Get the PWM on and off times for an LED """
     self._checkLED(led)
-    on = self._getTwoBytes(PCA9685.LED_ON_L[led], PCA9685.LED_ON_H[led])
-    off = self._getTwoBytes(PCA9685.LED_OFF_L[led], PCA9685.LED_OFF_H[led])
+    r = self._i2c.readfrom_mem(self._address, PCA9685._ledBase(led), 4)
+    on = 256 * r[1] + r[0]
+    off = 256 * r[3] + r[2]
     return (on, off)
   
   def setDuty(self, led, rate):
@@ -197,16 +334,25 @@ class PCA9685:
     0 means off, 4096 means on.
     In between, the PWM signal will start at 0 and stop at rate
     """
-    if (rate < 0):
-      rate = 0
-    if (rate > 4096):
-      rate = 4096
-    if (rate == 0):
+    if _DEBUG:
+      self._checkLED(led)
+    rate = 0 if rate < 0 else (4096 if rate > 4096 else rate)
+    if (0 <= led < 16) and (self._duty[led] == rate):
+      return  # already set
+    if _native_set_duty:
+      _native_set_duty(self._i2c, self._address, led, rate, self._buf4)
+    elif (rate == 0):
       self.setPWM(led, 0, 4096)
     elif (rate == 4096):
       self.setPWM(led, 4096, 0)
     else:
       self.setPWM(led, 0, rate)
+    if led == 16:
+      duty = self._duty
+      for i in range(16):
+        duty[i] = rate
+    elif led >= 0:  # a negative index would update the shadow of another LED
+      self._duty[led] = rate
   
   def setDutyPct(self, led, pct):
     """
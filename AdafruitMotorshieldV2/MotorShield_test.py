@@ -39,6 +39,17 @@ print('Release stepper')
 # release the motor (let it turn freely)
 s.release()
 
+print('Block write after a single channel write')
+# setDutyBlock must send the current duty cycle of the LEDs that it does not change
+pca.setDutyBlock(8, (0, 0, 0, 0))
+pca.setDuty(9, 4096)
+pca.setDutyBlock(8, (4096, 4096, 4096, 0))
+if pca.getPWM(9) == (4096, 0):
+  print('OK')
+else:
+  print('FAILED: LED 9 is', pca.getPWM(9))
+pca.setDutyBlock(8, (0, 0, 0, 0))
+
 # Create a DC motor on port M3
 m = DCMotor(pca, 3)
 print('Half throttle')
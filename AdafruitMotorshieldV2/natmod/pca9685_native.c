@@ -0,0 +1,59 @@
+/*
+ * pca9685_native.c a Micropython native module for the PCA9685 register writes
+ * used by ESP32_pca9685fb.py.
+ *
+ * Build with:  make ARCH=xtensawin
+ * and copy pca9685_native.mpy next to ESP32_pca9685fb.py on the board.
+ *
+ * © Frédéric Boulanger <frederic.softdev@gmail.com>
+ * This software is licensed under the Eclipse Public License 2.0
+ */
+#include "py/dynruntime.h"
+
+#define LED0_ON_L 6     // LSB of the ON counter for LED 0
+#define ALL_ON_L  250   // All LEDs on time LSB
+#define LED_BIT   0x10  // full ON or full OFF bit in the ON_H and OFF_H registers
+
+// set_duty(i2c, address, led, rate, buf)
+// Set the duty cycle of an LED with one writeto_mem of its 4 registers.
+// 'rate' must already be in 0..4096, 'led' in 0..16 (16 is all LEDs).
+// 'buf' is a bytearray of 4 bytes owned by the caller, it is filled with the
+// register values and reused at each call, so that no object is allocated.
+static mp_obj_t set_duty(size_t n_args, const mp_obj_t *args) {
+    mp_int_t led = mp_obj_get_int(args[2]);
+    mp_int_t rate = mp_obj_get_int(args[3]);
+    mp_buffer_info_t bufinfo;
+    mp_get_buffer_raise(args[4], &bufinfo, MP_BUFFER_WRITE);
+    if (bufinfo.len < 4) {
+        mp_raise_ValueError(MP_ERROR_TEXT("buffer too small"));
+    }
+    uint8_t *buf = bufinfo.buf;
+    buf[0] = buf[1] = buf[2] = buf[3] = 0;
+    if (rate <= 0) {
+        buf[3] = LED_BIT;
+    } else if (rate >= 4096) {
+        buf[1] = LED_BIT;
+    } else {
+        buf[2] = rate & 0xFF;
+        buf[3] = rate >> 8;
+    }
+    mp_int_t reg = (led == 16) ? ALL_ON_L : LED0_ON_L + (led << 2);
+
+    // i2c.writeto_mem(address, reg, buf)
+    mp_obj_t dest[5];
+    mp_load_method(args[0], MP_QSTR_writeto_mem, dest);
+    dest[2] = args[1];
+    dest[3] = MP_OBJ_NEW_SMALL_INT(reg);
+    dest[4] = args[4];
+    mp_call_method_n_kw(3, 0, dest);
+    return mp_const_none;
+}
+static MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(set_duty_obj, 5, 5, set_duty);
+
+mp_obj_t mpy_init(mp_obj_fun_bc_t *self, size_t n_args, size_t n_kw, mp_obj_t *args) {
+    MP_DYNRUNTIME_INIT_ENTRY
+
+    mp_store_global(MP_QSTR_set_duty, MP_OBJ_FROM_PTR(&set_duty_obj));
+
+    MP_DYNRUNTIME_INIT_EXIT
+}
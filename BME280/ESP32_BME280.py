@@ -9,206 +9,304 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
-import sys
+import micropython
+from micropython import const
+import struct
+import utime
+import uasyncio as asyncio
+
+# Layout of the compensation parameters, which are all little endian
+_CAL_TP_FMT = '<HhhHhhhhhhhh'   # dig_T1 to dig_P9 at 0x88
+_CAL_H23_FMT = '<hB'            # dig_H2 and dig_H3 at 0xE1
+_CAL_H6_FMT = '<b'              # dig_H6 at 0xE7
+# Layout of the packed parameters used by the viper code, one 16 bits word each:
+# dig_T1 to dig_T3, dig_P1 to dig_P9, dig_H1 to dig_H6
+_CAL_FMT = '<HhhHhhhhhhhhHhHhhh'
+
+# Constants of the barometric formula
+_BAROM_EXP = 5.256              # exponent of the barometric formula
+_INV_BAROM_EXP = 1 / _BAROM_EXP
+_LAPSE_RATE = 0.0065            # temperature lapse rate in K/m
+_KELVIN = 273.15                # 0 °C in Kelvin
+# Coefficients of x^2 and x^3 in the Taylor expansion of (1 + x)^5.256
+_BAROM_C2 = _BAROM_EXP * (_BAROM_EXP - 1) / 2
+_BAROM_C3 = _BAROM_C2 * (_BAROM_EXP - 2) / 3
+
+# Adresses of the different registers of the BME280
+_DIG_T1 = const(0x88)  # 0x88 (LSB) and 0x89 (MSB) of compensation param T1
+_DIG_T2 = const(0x8A)  # 0x8A (LSB) and 0x8B (MSB) of compensation param T2
+_DIG_T3 = const(0x8C)  # 0x8C (LSB) and 0x8D (MSB) of compensation param T3
+_DIG_P1 = const(0x8E)  # 0x8E (LSB) and 0x8F (MSB) of compensation param P1
+_DIG_P2 = const(0x90)  # 0x90 (LSB) and 0x91 (MSB) of compensation param P2
+_DIG_P3 = const(0x92)  # 0x92 (LSB) and 0x93 (MSB) of compensation param P3
+_DIG_P4 = const(0x94)  # 0x94 (LSB) and 0x95 (MSB) of compensation param P4
+_DIG_P5 = const(0x96)  # 0x96 (LSB) and 0x97 (MSB) of compensation param P5
+_DIG_P6 = const(0x98)  # 0x98 (LSB) and 0x99 (MSB) of compensation param P6
+_DIG_P7 = const(0x9A)  # 0x9A (LSB) and 0x9B (MSB) of compensation param P7
+_DIG_P8 = const(0x9C)  # 0x9C (LSB) and 0x9D (MSB) of compensation param P8
+_DIG_P9 = const(0x9E)  # 0x9E (LSB) and 0x9F (MSB) of compensation param P9
+_DIG_H1 = const(0xA1)  # 0xA1 compensation param H1
+_DIG_H2 = const(0xE1)  # 0xE1 (LSB) and 0xE2 (MSB) of compensation param H2
+_DIG_H3 = const(0xE3)  # 0xE3 compensation param H3
+_DIG_H4 = const(0xE4)  # 0xE4 (MSB) and 0xE5 (3 LS bits) of compensation param H4
+_DIG_H5 = const(0xE5)  # 0xE5 (LSB) and 0xE6 (MSB) of compensation param H5
+_DIG_H6 = const(0xE7)  # 0xE7 compensation param H6
+
+_ID_REG = const(0xD0)         # ID of the chip
+_RST_REG = const(0xE0)        # Write 0xB6 to reset the sensor
+_HUM_CTRL_REG = const(0xF2)   # Oversampling of humidity data
+_STAT_REG = const(0xF3)       # Status register
+_MEAS_REG = const(0xF4)       # Measure control register
+_CONF_REG = const(0xF5)       # Configuration of the measures
+_PRESS_REG = const(0xF7)      # 0xF7 to 0xF9: pressure MSB to LSB
+_TEMP_REG = const(0xFA)       # 0xFA to 0xFC: temperature MSB to LSB
+_HUM_REG = const(0xFD)        # 0xFD to 0xFE: humidity MSB and LSB
+
+# Status register contents
+_MEASURING = const(0b1000)
+_UPDATING  = const(0b0001)
+
+# Measuring and oversampling
+_SKIP = const(0b000)
+_OVRSAMP_1 = const(0b001)
+_OVRSAMP_2 = const(0b010)
+_OVRSAMP_4 = const(0b011)
+_OVRSAMP_8 = const(0b100)
+_OVRSAMP_16 = const(0b101)
+
+# Measuring and oversampling of temperature and pressure
+_TEMP_CTRL = const(5)  # bits 5, 6 and 7 of the MEAS_REG register
+_PRESS_CTRL = const(2) # bits 2, 3 and 4 of the MEAS_REG register
+_SENS_MODE = const(0)  # bits 0 and 1 of the MEAS_REG register
+
+_HUM_MASK = const(0b00000111)
+# Modes fror MEAS_REG register
+_TEMP_MASK = const(0b11100000)
+_PRESS_MASK = const(0b00011100)
+_MODE_MASK = const(0b00000011)
+_SLEEP_MODE = const(0b00)
+_FORCED_MODE = const(0b01)
+_NORMAL_MODE = const(0b11)
+
+# Configuration
+_STDBY_MASK = const(0b11100000)
+_STDBY_TIME = const(5)    # bits 5, 6 and 7 of CONF_REG
+_IIR_MASK = const(0b00011100)
+_IIR_FILT = const(2)      # bits 2, 3 and 4 of CONF_REG
+
+# Standby times (bits 5, 6 and 7 of CONF_REG)
+_HALF_MS = const(0b000)
+_SIXTYTWODOTFIVE_MS = const(0b001)
+_HUNDREDTWENTYFIVE_MS = const(0b010)
+_TWOHUNDREDSFIFTY_MS = const(0b011)
+_FIVEHUNDREDS_MS = const(0b100)
+_THOUSAND_MS = const(0b101)
+_TEN_MS = const(0b110)
+_TWENTY_MS = const(0b111)
+
+# IIR filter settings
+_IIR_OFF = const(0b000)    # No filtering
+_IIR_2 = const(0b001)      # Average on a sliding window of 2 samples
+_IIR_4 = const(0b010)      # Average on a sliding window of 4 samples
+_IIR_8 = const(0b011)      # Average on a sliding window of 8 samples
+_IIR_16 = const(0b100)     # Average on a sliding window of 16 samples
 
 class BME280 :
-  # Adresses of the different registers of the BME280
-  DIG_T1 = 0x88  # 0x88 (LSB) and 0x89 (MSB) of compensation param T1
-  DIG_T2 = 0x8A  # 0x8A (LSB) and 0x8B (MSB) of compensation param T2
-  DIG_T3 = 0x8C  # 0x8C (LSB) and 0x8D (MSB) of compensation param T3
-  DIG_P1 = 0x8E  # 0x8E (LSB) and 0x8F (MSB) of compensation param P1
-  DIG_P2 = 0x90  # 0x90 (LSB) and 0x91 (MSB) of compensation param P2
-  DIG_P3 = 0x92  # 0x92 (LSB) and 0x93 (MSB) of compensation param P3
-  DIG_P4 = 0x94  # 0x94 (LSB) and 0x95 (MSB) of compensation param P4
-  DIG_P5 = 0x96  # 0x96 (LSB) and 0x97 (MSB) of compensation param P5
-  DIG_P6 = 0x98  # 0x98 (LSB) and 0x99 (MSB) of compensation param P6
-  DIG_P7 = 0x9A  # 0x9A (LSB) and 0x9B (MSB) of compensation param P7
-  DIG_P8 = 0x9C  # 0x9C (LSB) and 0x9D (MSB) of compensation param P8
-  DIG_P9 = 0x9E  # 0x9E (LSB) and 0x9F (MSB) of compensation param P9
-  DIG_H1 = 0xA1  # 0xA1 compensation param H1
-  DIG_H2 = 0xE1  # 0xE1 (LSB) and 0xE2 (MSB) of compensation param H2
-  DIG_H3 = 0xE3  # 0xE3 compensation param H3
-  DIG_H4 = 0xE4  # 0xE4 (MSB) and 0xE5 (3 LS bits) of compensation param H4
-  DIG_H5 = 0xE5  # 0xE5 (LSB) and 0xE6 (MSB) of compensation param H5
-  DIG_H6 = 0xE7  # 0xE7 compensation param H6
+  # Register addresses and bit fields, see the module constants above
+  DIG_T1 = _DIG_T1
+  DIG_T2 = _DIG_T2
+  DIG_T3 = _DIG_T3
+  DIG_P1 = _DIG_P1
+  DIG_P2 = _DIG_P2
+  DIG_P3 = _DIG_P3
+  DIG_P4 = _DIG_P4
+  DIG_P5 = _DIG_P5
+  DIG_P6 = _DIG_P6
+  DIG_P7 = _DIG_P7
+  DIG_P8 = _DIG_P8
+  DIG_P9 = _DIG_P9
+  DIG_H1 = _DIG_H1
+  DIG_H2 = _DIG_H2
+  DIG_H3 = _DIG_H3
+  DIG_H4 = _DIG_H4
+  DIG_H5 = _DIG_H5
+  DIG_H6 = _DIG_H6
   
-  ID_REG = 0xD0         # ID of the chip
-  RST_REG = 0xE0        # Write 0xB6 to reset the sensor
-  HUM_CTRL_REG = 0xF2   # Oversampling of humidity data
-  STAT_REG = 0xF3       # Status register
-  MEAS_REG = 0xF4       # Measure control register
-  CONF_REG = 0xF5       # Configuration of the measures
-  PRESS_REG = 0xF7      # 0xF7 to 0xF9: pressure MSB to LSB
-  TEMP_REG = 0xFA       # 0xFA to 0xFC: temperature MSB to LSB
-  HUM_REG = 0xFD        # 0xFD to 0xFE: humidity MSB and LSB
-
-  # Status register contents
-  MEASURING = 0b1000
-  UPDATING  = 0b0001
+  ID_REG = _ID_REG
+  RST_REG = _RST_REG
+  HUM_CTRL_REG = _HUM_CTRL_REG
+  STAT_REG = _STAT_REG
+  MEAS_REG = _MEAS_REG
+  CONF_REG = _CONF_REG
+  PRESS_REG = _PRESS_REG
+  TEMP_REG = _TEMP_REG
+  HUM_REG = _HUM_REG
   
-  # Measuring and oversampling
-  SKIP = 0b000
-  OVRSAMP_1 = 0b001
-  OVRSAMP_2 = 0b010
-  OVRSAMP_4 = 0b011
-  OVRSAMP_8 = 0b100
-  OVRSAMP_16 = 0b101
+  MEASURING = _MEASURING
+  UPDATING = _UPDATING
   
-  # Measuring and oversampling of temperature and pressure
-  TEMP_CTRL = 5  # bits 5, 6 and 7 of the MEAS_REG register
-  PRESS_CTRL = 2 # bits 2, 3 and 4 of the MEAS_REG register
-  SENS_MODE = 0  # bits 0 and 1 of the MEAS_REG register
+  SKIP = _SKIP
+  OVRSAMP_1 = _OVRSAMP_1
+  OVRSAMP_2 = _OVRSAMP_2
+  OVRSAMP_4 = _OVRSAMP_4
+  OVRSAMP_8 = _OVRSAMP_8
+  OVRSAMP_16 = _OVRSAMP_16
   
-  HUM_MASK = 0b00000111
-  # Modes fror MEAS_REG register
-  TEMP_MASK = 0b11100000
-  PRESS_MASK = 0b00011100
-  MODE_MASK = 0b00000011
-  SLEEP_MODE = 0b00
-  FORCED_MODE = 0b01
-  NORMAL_MODE = 0b11
+  TEMP_CTRL = _TEMP_CTRL
+  PRESS_CTRL = _PRESS_CTRL
+  SENS_MODE = _SENS_MODE
   
-  # Configuration
-  STDBY_MASK = 0b11100000
-  STDBY_TIME = 5    # bits 5, 6 and 7 of CONF_REG
-  IIR_MASK = 0b00011100
-  IIR_FILT = 2      # bits 2, 3 and 4 of CONF_REG
+  HUM_MASK = _HUM_MASK
+  TEMP_MASK = _TEMP_MASK
+  PRESS_MASK = _PRESS_MASK
+  MODE_MASK = _MODE_MASK
+  SLEEP_MODE = _SLEEP_MODE
+  FORCED_MODE = _FORCED_MODE
+  NORMAL_MODE = _NORMAL_MODE
   
-  # Standby times (bits 5, 6 and 7 of CONF_REG)
-  HALF_MS = 0b000
-  SIXTYTWODOTFIVE_MS = 0b001
-  HUNDREDTWENTYFIVE_MS = 0b010
-  TWOHUNDREDSFIFTY_MS = 0b011
-  FIVEHUNDREDS_MS = 0b100
-  THOUSAND_MS = 0b101
-  TEN_MS = 0b110
-  TWENTY_MS = 0b111
+  STDBY_MASK = _STDBY_MASK
+  STDBY_TIME = _STDBY_TIME
+  IIR_MASK = _IIR_MASK
+  IIR_FILT = _IIR_FILT
   
-  # IIR filter settings
-  IIR_OFF = 0b000    # No filtering
-  IIR_2 = 0b001      # Average on a sliding window of 2 samples
-  IIR_4 = 0b010      # Average on a sliding window of 4 samples
-  IIR_8 = 0b011      # Average on a sliding window of 8 samples
-  IIR_16 = 0b100     # Average on a sliding window of 16 samples
+  HALF_MS = _HALF_MS
+  SIXTYTWODOTFIVE_MS = _SIXTYTWODOTFIVE_MS
+  HUNDREDTWENTYFIVE_MS = _HUNDREDTWENTYFIVE_MS
+  TWOHUNDREDSFIFTY_MS = _TWOHUNDREDSFIFTY_MS
+  FIVEHUNDREDS_MS = _FIVEHUNDREDS_MS
+  THOUSAND_MS = _THOUSAND_MS
+  TEN_MS = _TEN_MS
+  TWENTY_MS = _TWENTY_MS
   
-  """
-  Convert bytes into an integer according to endianness ("little" or "big")
-  and signedness
-  """
-  @staticmethod
-  def int_from_bytes(b, endian = sys.byteorder, signed=False) :
-    value = int.from_bytes(b, endian)
-    if not signed :
-      return value
-    width = len(b) * 8
-    if value > (1 << (width - 1)) -1 :
-      value -= (1 << width)
-    return value
+  IIR_OFF = _IIR_OFF
+  IIR_2 = _IIR_2
+  IIR_4 = _IIR_4
+  IIR_8 = _IIR_8
+  IIR_16 = _IIR_16
   
   """
   Initialize a BME280 sensor on I2C bus with the given SCL and SDA pins,
   at the given address on the I2C bus.
+  When 'sda' is None, 'scl' is an already configured machine.I2C bus, which
+  can be shared with other devices, as in BME280(i2c, address = 0x76).
   """
-  def __init__(self, scl, sda, address = 0x76) :
-    self.i2c = machine.I2C(scl=scl, sda=sda)
+  def __init__(self, scl, sda = None, address = 0x76) :
+    if sda is None :
+      self.i2c = scl
+    else :
+      self.i2c = machine.I2C(scl=scl, sda=sda)
     self.addr = address
     try :
-      self.id = BME280.int_from_bytes(self.i2c.readfrom_mem(self.addr, self.ID_REG, 1))
+      self.id = self.i2c.readfrom_mem(self.addr, _ID_REG, 1)[0]
     except OSError :
       raise ValueError('No BME280 device on I2C bus at address ' + str(self.addr))
     if self.id != 0x60 :
       raise ValueError('I2C device at address ' + str(self.addr) + ' is not a BME280')
     
-    buf = bytearray(2)
-    
-    # Read the compensation parameters
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_T1, buf)
-    self.dig_T1 = BME280.int_from_bytes(buf, "little")
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_T2, buf)
-    self.dig_T2 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_T3, buf)
-    self.dig_T3 = BME280.int_from_bytes(buf, "little", signed = True)
+    # Read the compensation parameters in two bursts:
+    # 0x88 to 0xA1 for dig_T1 to dig_P9 and dig_H1, 0xE1 to 0xE7 for dig_H2 to dig_H6
+    buf = bytearray(26)
+    self.i2c.readfrom_mem_into(self.addr, _DIG_T1, buf)
+    cal = struct.unpack_from(_CAL_TP_FMT, buf)
+    dig_H1 = buf[_DIG_H1 - _DIG_T1]
+    # The pressure parameters as a tuple, so that compensation() gets them all at once
+    self._dig_P = cal[3:]
     
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P1, buf)
-    self.dig_P1 = BME280.int_from_bytes(buf, "little")
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P2, buf)
-    self.dig_P2 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P3, buf)
-    self.dig_P3 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P4, buf)
-    self.dig_P4 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P5, buf)
-    self.dig_P5 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P6, buf)
-    self.dig_P6 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P7, buf)
-    self.dig_P7 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P8, buf)
-    self.dig_P8 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_P9, buf)
-    self.dig_P9 = BME280.int_from_bytes(buf, "little", signed = True)
+    buf = bytearray(7)
+    self.i2c.readfrom_mem_into(self.addr, _DIG_H2, buf)
+    dig_H2, dig_H3 = struct.unpack_from(_CAL_H23_FMT, buf)
+    dig_H4 = (buf[3] << 4) | (buf[4] & 0b1111)
+    dig_H5 = (buf[5] << 4) | ((buf[4] >> 4) & 0b1111)
+    dig_H6 = struct.unpack_from(_CAL_H6_FMT, buf, 6)[0]
     
-    self.dig_H1 = BME280.int_from_bytes(self.i2c.readfrom_mem(self.addr, BME280.DIG_H1, 1), "little")
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_H2, buf)
-    self.dig_H2 = BME280.int_from_bytes(buf, "little", signed = True)
-    self.dig_H3 = BME280.int_from_bytes(self.i2c.readfrom_mem(self.addr, BME280.DIG_H3, 1), "little")
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_H4, buf)
-    self.dig_H4 = (buf[0] << 4) | (buf[1] & 0b1111)
-    self.i2c.readfrom_mem_into(self.addr, BME280.DIG_H5, buf)
-    self.dig_H5 = (buf[1] << 4) | ((buf[0] >> 4) & 0b1111)
-    self.dig_H6 = BME280.int_from_bytes(self.i2c.readfrom_mem(self.addr, BME280.DIG_H6, 1), "little", signed = True)
+    # All the parameters packed in one buffer for the viper code
+    self._cal = bytearray(36)
+    struct.pack_into(_CAL_FMT, self._cal, 0, *(cal + (dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6)))
     
     # Set humidity measurements with no oversampling
     buf = bytearray(1)
-    buf[0] = BME280.OVRSAMP_1
-    self.i2c.writeto_mem(self.addr, BME280.HUM_CTRL_REG, buf)
+    buf[0] = _OVRSAMP_1
+    self.i2c.writeto_mem(self.addr, _HUM_CTRL_REG, buf)
     # Set temperature and pressure measurements with no oversampling
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~(BME280.TEMP_MASK | BME280.PRESS_MASK)
-    buf[0] |= (BME280.OVRSAMP_1 << BME280.TEMP_CTRL) \
-            | (BME280.OVRSAMP_1 << BME280.PRESS_CTRL)
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    buf[0] &= ~(_TEMP_MASK | _PRESS_MASK)
+    buf[0] |= (_OVRSAMP_1 << _TEMP_CTRL) \
+            | (_OVRSAMP_1 << _PRESS_CTRL)
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, buf)
+    
+    # Buffer and dictionnary reused by measure() to avoid allocations
+    self._meas_buf = bytearray(8)
+    self._results = {'temp': 0, 'press': 0, 'hum': 0}
+    # Buffer for the mode and status registers in oneshot()
+    self._stat_buf = bytearray(1)
 
   """
   Put the BME280 sensor in sleep mode (no measurement)
   """
   def sleepmode(self) :
     buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~BME280.MODE_MASK
-    buf[0] |= BME280.SLEEP_MODE
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    buf[0] &= ~_MODE_MASK
+    buf[0] |= _SLEEP_MODE
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, buf)
+  
+  """
+  Start one measurement, the sensor goes back to sleep mode when it is done.
+  Returns the preallocated buffer used for polling the status register.
+  """
+  def _startOneshot(self) :
+    buf = self._stat_buf
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    buf[0] &= ~_MODE_MASK
+    buf[0] |= _FORCED_MODE
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, buf)
+    return buf
+  
+  """
+  Tell whether the measurement is finished and the registers are updated,
+  using 'buf' to read the status register.
+  """
+  def _oneshotDone(self, buf) :
+    self.i2c.readfrom_mem_into(self.addr, _STAT_REG, buf)
+    return (buf[0] & (_MEASURING | _UPDATING)) == 0
   
   """
   Make one measurement and go back to sleep mode
   """
   def oneshot(self) :
-    buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~BME280.MODE_MASK
-    buf[0] |= BME280.FORCED_MODE
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
+    buf = self._startOneshot()
     # Wait for measurement to finish and for registers to be updated
-    while (self.i2c.readfrom_mem(self.addr, BME280.STAT_REG, 1)[0]
-        & (BME280.MEASURING | BME280.UPDATING)) != 0 :
-    	pyb.delay(5)
+    while not self._oneshotDone(buf) :
+      utime.sleep_us(200)
+  
+  """
+  Coroutine version of oneshot(), which lets other tasks run while
+  the measurement is in progress.
+  """
+  async def oneshotAsync(self) :
+    buf = self._startOneshot()
+    while not self._oneshotDone(buf) :
+      await asyncio.sleep_ms(1)
   
   """
   Put the BME280 sensor in normal mode, with periodic measurements 
   separated by the standby duration (default is 0.5ms)
   """
   def normalmode(self, standby = 0) :
-    buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~BME280.MODE_MASK
-    buf[0] |= BME280.NORMAL_MODE
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
-    if standby < 0 or standby > BME280.TWENTY_MS :
-    	standby = BME280.HALF_MS
-    self.i2c.readfrom_mem_into(self.addr, BME280.CONF_REG, buf)
-    buf[0] &= ~BME280.STDBY_MASK
-    buf[0] |= (standby << BME280.STDBY_TIME)
-    self.i2c.writeto_mem(self.addr, BME280.CONF_REG, buf)
+    if standby < 0 or standby > _TWENTY_MS :
+    	standby = _HALF_MS
+    # Read MEAS_REG and CONF_REG at once
+    buf = bytearray(2)
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    conf = memoryview(buf)[1:]
+    # Set the standby time first because writes to CONF_REG may be ignored in normal mode
+    conf[0] &= ~_STDBY_MASK
+    conf[0] |= (standby << _STDBY_TIME)
+    self.i2c.writeto_mem(self.addr, _CONF_REG, conf)
+    meas = memoryview(buf)[:1]
+    meas[0] &= ~_MODE_MASK
+    meas[0] |= _NORMAL_MODE
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, meas)
     
   """
   Configure the IIR filter.
@@ -216,13 +314,13 @@ class BME280 :
   sliding window of 2, 4, 8 or 16 samples (IIR_2, IIR_4, IIR_8 and IIR_16)
   """
   def filtering(self, coef) :
-    if not coef in [BME280.IIR_OFF, BME280.IIR_2, BME280.IIR_4, BME280.IIR_8, BME280.IIR_16] :
-      raise ValueException("IIR coefficient " + str(coef) + " is invalid")
+    if not _IIR_OFF <= coef <= _IIR_16 :
+      raise ValueError("IIR coefficient " + str(coef) + " is invalid")
     buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.CONF_REG, buf)
-    buf[0] &= ~BME280.IIR_MASK
-    buf[0] |= (coef << BME280.IIR_FILT)
-    self.i2c.writeto_mem(self.addr, BME280.CONF_REG, buf)
+    self.i2c.readfrom_mem_into(self.addr, _CONF_REG, buf)
+    buf[0] &= ~_IIR_MASK
+    buf[0] |= (coef << _IIR_FILT)
+    self.i2c.writeto_mem(self.addr, _CONF_REG, buf)
   
   """
   Set the humidity measurement mode.
@@ -231,13 +329,13 @@ class BME280 :
   or 16 times (OVRSAMP_16)
   """
   def humidity_mode(self, mode) :
-    if not mode in [BME280.SKIP, BME280.OVRSAMP_1, BME280.OVRSAMP_2, BME280.OVRSAMP_4, BME280.OVRSAMP_8, BME280.OVRSAMP_16] :
-      raise ValueException("Mode " + str(mode) + " is invalid")
+    if not _SKIP <= mode <= _OVRSAMP_16 :
+      raise ValueError("Mode " + str(mode) + " is invalid")
     buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.HUM_CTRL_REG, buf)
-    buf[0] &= ~BME280.HUM_MASK
+    self.i2c.readfrom_mem_into(self.addr, _HUM_CTRL_REG, buf)
+    buf[0] &= ~_HUM_MASK
     buf[0] |= mode
-    self.i2c.writeto_mem(self.addr, BME280.HUM_CTRL_REG, buf)
+    self.i2c.writeto_mem(self.addr, _HUM_CTRL_REG, buf)
     
   """
   Set the temperature measurement mode.
@@ -248,13 +346,13 @@ class BME280 :
   temperature is used in the compensation computations for the pressure and humidity.
   """
   def temperature_mode(self, mode) :
-    if not mode in [BME280.SKIP, BME280.OVRSAMP_1, BME280.OVRSAMP_2, BME280.OVRSAMP_4, BME280.OVRSAMP_8, BME280.OVRSAMP_16] :
-      raise ValueException("Mode " + str(mode) + " is invalid")
+    if not _SKIP <= mode <= _OVRSAMP_16 :
+      raise ValueError("Mode " + str(mode) + " is invalid")
     buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~BME280.TEMP_MASK
-    buf[0] |= (mode << BME280.TEMP_CTRL)
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    buf[0] &= ~_TEMP_MASK
+    buf[0] |= (mode << _TEMP_CTRL)
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, buf)
     
   """
   Set the pressure measurement mode
@@ -263,13 +361,13 @@ class BME280 :
   or 16 times (OVRSAMP_16)
   """
   def pressure_mode(self, mode) :
-    if not mode in [BME280.SKIP, BME280.OVRSAMP_1, BME280.OVRSAMP_2, BME280.OVRSAMP_4, BME280.OVRSAMP_8, BME280.OVRSAMP_16] :
-      raise ValueException("Mode " + str(mode) + " is invalid")
+    if not _SKIP <= mode <= _OVRSAMP_16 :
+      raise ValueError("Mode " + str(mode) + " is invalid")
     buf = bytearray(1)
-    self.i2c.readfrom_mem_into(self.addr, BME280.MEAS_REG, buf)
-    buf[0] &= ~BME280.PRESS_MASK
-    buf[0] |= (mode << BME280.PRESS_CTRL)
-    self.i2c.writeto_mem(self.addr, BME280.MEAS_REG, buf)
+    self.i2c.readfrom_mem_into(self.addr, _MEAS_REG, buf)
+    buf[0] &= ~_PRESS_MASK
+    buf[0] |= (mode << _PRESS_CTRL)
+    self.i2c.writeto_mem(self.addr, _MEAS_REG, buf)
   
   """
   Get the raw ADC values from the last measurement in an 8 bytes buffer.
@@ -277,9 +375,60 @@ class BME280 :
   This method can be called in a ISR because is does not allocate memory.
   """
   def raw_measure(self, buf) :
-    self.i2c.readfrom_mem_into(self.addr, self.PRESS_REG, buf) # Read pressure, temperature and humidity all at once
+    self.i2c.readfrom_mem_into(self.addr, _PRESS_REG, buf) # Read pressure, temperature and humidity all at once
     return buf
   
+  """
+  Compute t_fine from the raw temperature in 'buf', using the 32 bits integer
+  formula of the data sheet. Compiled by viper to native integer code.
+  """
+  @micropython.viper
+  def _fine_temp(self, buf) -> int :
+    b = ptr8(buf)
+    c = ptr16(self._cal)
+    temp = ((b[3] << 16) | (b[4] << 8) | b[5]) >> 4
+    t1 = c[0]
+    t2 = c[1]
+    t2 -= (t2 & 0x8000) << 1  # sign extension of the 16 bits words
+    t3 = c[2]
+    t3 -= (t3 & 0x8000) << 1
+    v1 = (((temp >> 3) - (t1 << 1)) * t2) >> 11
+    v2 = (temp >> 4) - t1
+    v2 = (((v2 * v2) >> 12) * t3) >> 14
+    return v1 + v2
+  
+  """
+  Compute the relative humidity in hundredth of percent from the raw humidity
+  in 'buf' and 't_fine', using the 32 bits integer formula of the data sheet.
+  Compiled by viper to native integer code.
+  """
+  @micropython.viper
+  def _humidity(self, buf, t_fine:int) -> int :
+    b = ptr8(buf)
+    c = ptr16(self._cal)
+    hum = (b[6] << 8) | b[7]
+    h1 = c[12]
+    h2 = c[13]
+    h2 -= (h2 & 0x8000) << 1  # sign extension of the 16 bits words
+    h3 = c[14]
+    h4 = c[15]
+    h4 -= (h4 & 0x8000) << 1
+    h5 = c[16]
+    h5 -= (h5 & 0x8000) << 1
+    h6 = c[17]
+    h6 -= (h6 & 0x8000) << 1
+    h = t_fine - 76800
+    h = (((hum << 14) - (h4 << 20) - (h5 * h) + 16384) >> 15) \
+      * (((((((h * h6) >> 10) * (((h * h3) >> 11) + 32768)) >> 10) + 2097152) * h2 + 8192) >> 14)
+    h -= (((((h >> 15) * (h >> 15)) >> 7) * h1) >> 4)
+    # h >> 31 is all ones when h is negative, so this clears negative values without branching.
+    # The mask is inverted with ^ -1 because some viper versions do not support ~ on int.
+    h &= (h >> 31) ^ -1
+    if h > 419430400 :
+      h = 419430400
+    h >>= 12   # Relative humidity with 22 bits of integer part and 10 bits of fractional part
+    return (h * 100) >> 10 # Relative humidity in hundredth of percent
+  
   """
   Compensation computation for getting the temperature, the pressure and humidity
   from the raw ADC data from the sensors.
@@ -295,45 +444,32 @@ class BME280 :
       results = {}
     
     press = (buf[0] << 16 | buf[1] << 8 | buf[2]) >> 4
-    temp = (buf[3] << 16 | buf[4] << 8 | buf[5]) >> 4
-    hum = buf[6] << 8 | buf[7]
     
     # Compensation formulas from Bosch Sensortec BME280 data sheet
-    v1 = (((temp >> 3) - (self.dig_T1 << 1)) * (self.dig_T2)) >> 11
-    v2 = (temp >> 4) - self.dig_T1
-    v2 = (((v2 * v2) >> 12) * self.dig_T3) >> 14
-    t_fine = v1 + v2
+    t_fine = self._fine_temp(buf)
     
     temp = (t_fine * 5 + 128) >> 8 # value in hundredth of degree Celcius
     
+    # The pressure formula needs 64 bits integers, it stays in Python
+    P1, P2, P3, P4, P5, P6, P7, P8, P9 = self._dig_P
     v1 = t_fine - 128000
-    v2 = v1 * v1 * self.dig_P6
-    v2 += (v1 * self.dig_P5) << 17
-    v2 += (self.dig_P4 << 35)
-    v1 = ((v1 * v1 * self.dig_P3) >> 8) + ((v1 * self.dig_P2) << 12)
-    v1 = (((1 << 47) + v1) * self.dig_P1) >> 33
+    v2 = v1 * v1 * P6
+    v2 += (v1 * P5) << 17
+    v2 += (P4 << 35)
+    v1 = ((v1 * v1 * P3) >> 8) + ((v1 * P2) << 12)
+    v1 = (((1 << 47) + v1) * P1) >> 33
     if v1 == 0 :
       p = 0 # avoid exception caused by division by 0
     else :
       p = 1048576 - press
       p = (((p << 31) - v2) * 3125) // v1
-      v1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
-      v2 = (self.dig_P8 * p) >> 19
-      p = ((p + v1 + v2) >> 8) + (self.dig_P7 << 4) # Pressure in Pa with 24 bits of integer part and 8 bits of fractional part
+      v1 = (P9 * (p >> 13) * (p >> 13)) >> 25
+      v2 = (P8 * p) >> 19
+      p = ((p + v1 + v2) >> 8) + (P7 << 4) # Pressure in Pa with 24 bits of integer part and 8 bits of fractional part
       p //= 256 # value in pascal rounded to an integer
     
-    h = t_fine - 76800
-    h = (((hum << 14) - (self.dig_H4 << 20) - (self.dig_H5 * h) + 16384) >> 15) \
-      * (((((((h * self.dig_H6) >> 10) * (((h * self.dig_H3) >> 11) + 32768)) >> 10) + 2097152) * self.dig_H2 + 8192) >> 14)
-    h -= (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
-    if h < 0 :
-      h = 0
-    if h > 419430400 :
-      h = 419430400
-    h >>= 12   # Relative humidity with 22 bits of integer part and 10 bits of fractional part
-    h *= 100
-    h //= 1024 # Relative humidity in hundredth of percent
-      
+    h = self._humidity(buf, t_fine)
+    
     results['temp'] = temp
     results['press'] = p
     results['hum'] = h
@@ -344,11 +480,11 @@ class BME280 :
   The temperature ('temp' item of the dictionnary) is in 1/100 of °C
   The pressure ('press' item of the dictionnary) is pascal
   The relative humidity ('hum' item of the dictionnary) is in 1/100 of percent
+  The same dictionnary is returned by each call, copy it to keep the values.
   """
   def measure(self) :
-    buf = bytearray(8)
-    self.raw_measure(buf)
-    return self.compensation(buf)
+    self.raw_measure(self._meas_buf)
+    return self.compensation(self._meas_buf, self._results)
   
   """
   Compute the sea level pressure given a measurement and the current altitude in meters.
@@ -359,7 +495,12 @@ class BME280 :
     T = measurements['temp'] / 100
     P = measurements['press']
     
-    return ((1 + (altitude * 0.0065) / (T + 273.15)) ** 5.256) * P
+    x = (altitude * _LAPSE_RATE) / (T + _KELVIN)
+    if -0.01 < x < 0.01 :
+      # Below about 400m, three terms of the Taylor expansion are accurate
+      # to a few thousandths of pascal and avoid a costly float power
+      return (1 + x * (_BAROM_EXP + x * (_BAROM_C2 + x * _BAROM_C3))) * P
+    return ((1 + x) ** _BAROM_EXP) * P
 
   """
   Compute the altitude in meters given a measurement and the sea level pressure in Pa.
@@ -370,4 +511,4 @@ class BME280 :
     T = measurements['temp'] / 100
     P = measurements['press']
     
-    return (((sealevel_press / P) ** (1 / 5.256) -1) * (T + 273.15)) / 0.0065
+    return (((sealevel_press / P) ** _INV_BAROM_EXP -1) * (T + _KELVIN)) / _LAPSE_RATE
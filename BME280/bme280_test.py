@@ -18,14 +18,17 @@ from ESP32_BME280 import BME280
 
 # BME280 sensor
 bme = None
-# 8 bute buffer for storing raw measurement data
-data_buffer = None
+# Two 8 byte buffers for storing raw measurement data, and the index
+# of the buffer holding the latest measurement
+data_buffers = None
+data_index = None
 
 # Common intializations
 def init() :
-  global bme, data_buffer
+  global bme, data_buffers, data_index
   
-  data_buffer = bytearray(8)
+  data_buffers = (bytearray(8), bytearray(8))
+  data_index = bytearray(1)
   sda = machine.Pin(0)
   scl = machine.Pin(4)
   bme = BME280(scl, sda, 0x76)
@@ -68,9 +71,13 @@ def print_measures(buffer) :
 # data and store it in a preallocated buffer. Then we schedule the
 # 'print_measures' function to be called as soon as possible in a
 # normal context where memory can be allocated.
+# The two buffers are used alternately, so that the buffer being read by
+# 'print_measures' is not overwritten if the timer fires again meanwhile.
 def timer_isr(t) :
-  bme.raw_measure(data_buffer)
-  micropython.schedule(print_measures, data_buffer)
+  i = data_index[0] ^ 1
+  bme.raw_measure(data_buffers[i])
+  data_index[0] = i
+  micropython.schedule(print_measures, data_buffers[i])
 
 # Main program which sets up a timer to trigger a measurement
 # every 1.5 second and display the results
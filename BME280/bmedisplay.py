@@ -15,8 +15,10 @@ import utime
 def main() :
   sda = machine.Pin(0)
   scl = machine.Pin(4)
-  bme = BME280(scl, sda, 0x76)
-  display = HT16K334x7(scl, sda, 0x70)
+  # Both devices share the same I2C bus
+  i2c = machine.I2C(scl=scl, sda=sda)
+  bme = BME280(i2c, address = 0x76)
+  display = HT16K334x7(i2c, addr = 0x70)
   
   bme.normalmode()
   bme.filtering(BME280.IIR_8)
@@ -0,0 +1,14 @@
+############
+# manifest.py for freezing the BME280 and HCSR04 drivers into the ESP32 firmware.
+#
+# Build the firmware from ports/esp32 of the Micropython sources with:
+#   make BOARD=ESP32_GENERIC FROZEN_MANIFEST=<path to this file>
+#
+# © Frédéric Boulanger <frederic.softdev@gmail.com>
+# This software is licensed under the Eclipse Public License 2.0
+############
+# Keep the modules that are frozen by default for the board
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("ESP32_BME280.py")
+module("ESP32_HCSR04.py", base_path="../HCSR04")
@@ -51,28 +51,27 @@ class BMEserver (WebSocketServer) :
   def process_request(self, message) :
     if message is None :   # Close server
       return None
-    meas = self._bme.measure()
-    meas['press'] = BME280.sealevel_pressure(meas, self._altitude)
-    message = message.strip().split()
     if self._debug :
-      print("# Received: " + str(message))
-    if message[0] == "LED_ON" :
+      print("# Received:", message)
+    message = message.split()
+    request = message[0] if message else ""
+    if request == "LED_ON" :
       self._led.on()
-      answer = self.buildStatus(meas)
-    elif message[0] == "LED_OFF" :
+    elif request == "LED_OFF" :
       self._led.off()
-      answer = self.buildStatus(meas)
-    elif message[0] == "SET_ALT" :
+    elif request == "SET_ALT" :
       self._altitude = int(message[1])
-      meas = self._bme.measure()
-      meas['press'] = BME280.sealevel_pressure(meas, self._altitude)
-      answer = self.buildStatus(meas)
-    elif message[0] == "STAT" :
-      answer = self.buildStatus(meas)
-    else :
-      answer = "UNKNOWN REQUEST: " + message
+    elif request != "STAT" :
+      answer = "UNKNOWN REQUEST: " + request
+      if self._debug :
+        print("# Answered:", answer)
+      return answer
+    # Measure only once the request is known, and after a change of altitude
+    meas = self._bme.measure()
+    meas['press'] = BME280.sealevel_pressure(meas, self._altitude)
+    answer = self.buildStatus(meas)
     if self._debug :
-      print("# Answered: " + answer)
+      print("# Answered:", answer)
     return answer
   
   """
@@ -109,3 +108,6 @@ hsrv = MyHttpServer()                # Create the HTTP server on port 80
 wsrv = BMEserver(8080, debug=False)  # Create the web socket server on port 8080
 print("Point your browser at:", hsrv.start())  # Start the HTTP server
 print("Web socket URL:", wsrv.start())         # Start the web socket server
+while True :                                   # Process requests
+  hsrv.poll(20)
+  wsrv.poll(20)
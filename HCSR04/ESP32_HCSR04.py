@@ -6,7 +6,14 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
+import micropython
 import utime
+from micropython import const
+
+# Fixed point versions of HCSR04.speed15, HCSR04.refTemp and HCSR04.corr
+_SPEED15_CMPS = const(34000)   # speed of sound at 15°C in cm/s
+_REFTEMP_DECI = const(150)     # reference temperature in tenths of °C
+_CORR_CENTI = const(607)       # +6.07cm/s / tenth of °C, in hundredths of cm/s
 
 class HCSR04:
 	"""
@@ -20,6 +27,7 @@ class HCSR04:
 	speed15 = 340    # 340m/s at 15°C
 	refTemp = 15     # reference temperature in Celsius
 	corr = 0.607     # +0.607m/s / °C
+	tempTTL = 1000   # the BME280 temperature is read at most once per second
 	
 	
 	def __init__(self, trig, echo, tmp36 = None, bme280 = None):
@@ -35,36 +43,67 @@ class HCSR04:
 		self.echo = machine.Pin(echo, mode = machine.Pin.IN, pull = None)
 		self.tmp36 = tmp36
 		self.bme280 = bme280
+		self._last_temp = _REFTEMP_DECI
+		self._last_temp_time = None
 
+	def _temperature(self):
+		"""
+		Return the temperature in tenths of Celsius used to adjust the speed of sound.
+		"""
+		temp = _REFTEMP_DECI
+		if self.tmp36 != None :
+			temp = self.tmp36.temp()
+		if self.bme280 != None :
+			# The temperature does not change quickly, avoid an I2C transfer on each ping
+			now = utime.ticks_ms()
+			if self._last_temp_time == None or utime.ticks_diff(now, self._last_temp_time) > HCSR04.tempTTL :
+				self._last_temp = self.bme280.measure()['temp'] // 10
+				self._last_temp_time = now
+			temp = self._last_temp
+		return temp
+	
+	def _ping(self):
+		"""
+		Send one ultrasound burst and return the duration of the echo in µs.
+		The trigger input must already be low.
+		"""
+		self.trig.value(1)
+		utime.sleep_us(11)
+		self.trig.value(0)
+		return machine.time_pulse_us(self.echo, 1)
+	
+	@micropython.native
+	def _toDistance(self, elapsed, temp):
+		"""
+		Convert an echo duration in µs to a distance in centimeters at a temperature
+		of temp tenths of Celsius. The speed of sound is computed in integer cm/s,
+		and the product with the duration stays a small int up to about 30000 µs.
+		"""
+		speed = _SPEED15_CMPS + ((temp - _REFTEMP_DECI) * _CORR_CENTI) // 100
+		# speed cm/s * elapsed E-6 s / 2
+		return (speed * elapsed) / 2000000
+	
 	def measure(self):
 		"""
 		Perform one measure of distance, with result in centimeters.
 		"""
 		self.trig.value(0)
 		utime.sleep_ms(1)
-		self.trig.value(1)
-		utime.sleep_us(11)
-		self.trig.value(0)
-		elapsed = machine.time_pulse_us(self.echo, 1)
-		speed = HCSR04.speed15
-		temp = HCSR04.refTemp
-		if self.tmp36 != None :
-			temp = self.tmp36.temp() / 10
-		if self.bme280 != None :
-			temp = self.bme280.measure()['temp'] / 100
-		speed += (temp - HCSR04.refTemp) * HCSR04.corr
-		# speed m/s * elapsed E-6 s / 2 = 170 E -6 m = 170 E -4 cm
-		return (speed * elapsed) * 0.5E-4
+		return self._toDistance(self._ping(), self._temperature())
 	
 	def distance(self):
 		"""
 		Return the average of a series of 5 measures, in centimeters.
+		The temperature is read only once for the whole series.
 		"""
-		d = 0
+		temp = self._temperature()
+		self.trig.value(0)
+		utime.sleep_us(200)
+		# _ping() leaves the trigger low, so the pings can follow each other
+		elapsed = 0
 		for i in range(5) :
-			d += self.measure()
-			utime.sleep_ms(1)
-		return d / 5
+			elapsed += self._ping()
+		return self._toDistance(elapsed // 5, temp)
 	
 	def unlock(self):
 		"""
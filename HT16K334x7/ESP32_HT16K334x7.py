@@ -7,8 +7,27 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
+import struct
 import utime
 
+from micropython import const
+
+# Fill a 2-byte command (register, value) with a single call
+_pack_into = struct.pack_into
+
+# Address of the HT16K33 registers used for display (see HT16K334x7.register)
+_REG_DISP = const(0x00)		# for writing to the internal RAM
+_REG_SYS = const(0x20)		# for system setup
+_REG_DSP = const(0x80)		# for display setup
+_REG_DIM = const(0xE0)		# for dimming the display
+
+_DOTS_ADDR = const(0x04)	# address of the o'clock dots in the internal RAM
+_DOTS_ON = const(0x02)
+_DOTS_OFF = const(0x00)
+_CLOCK_ON = const(1)
+_CLOCK_OFF = const(0)
+_DP_ON = const(0x80)		# set bit for the decimal point
+
 class HT16K334x7:
 	"""
 	Driver for AdaFruit 4-digit 7-segment display with HT16K33 backpack.
@@ -19,24 +38,24 @@ class HT16K334x7:
 	
 	# Address of the HT16K33 registers used for display
 	register = {
-	  'dispAddr' : 0x00,	# for writing to the internal RAM
-	  'sysSetup' : 0x20,	# for system setup
-	  'dispSetup': 0x80,	# for display setup
-	  'dimming'	 : 0xE0		# for dimming the display
+	  'dispAddr' : _REG_DISP,	# for writing to the internal RAM
+	  'sysSetup' : _REG_SYS,	# for system setup
+	  'dispSetup': _REG_DSP,	# for display setup
+	  'dimming'	 : _REG_DIM		# for dimming the display
 	}
 
 	# Address of the digits in the internal RAM, from leftmost (0) to rightmost (3)
 	digAddr = (0x0, 0x2, 0x6, 0x8)
 	
 	# Address of the o'clock dots between digits 1 and 2
-	dotsAddr = 0x04
+	dotsAddr = _DOTS_ADDR
 
-	dotsOn	= 0x02
-	dotsOff = 0x00
+	dotsOn	= _DOTS_ON
+	dotsOff = _DOTS_OFF
 	
 	# Values for the system setup register
-	clockOn		= 1
-	clockOff	= 0
+	clockOn		= _CLOCK_ON
+	clockOff	= _CLOCK_OFF
 
 	# Values for the display setup register
 	dispOn		= 1			# display on
@@ -46,7 +65,7 @@ class HT16K334x7:
 	blink1Hz	= 0b100		# blink at 1Hz
 	blinkHalfHz = 0b110		# blink at 0.5Hz
 
-	decimalPointOn	= 0x80	# set bit for the decimal point
+	decimalPointOn	= _DP_ON	# set bit for the decimal point
 	decimalPointOff = 0x00
 	
 	# format: dp g f e d c b a
@@ -72,6 +91,9 @@ class HT16K334x7:
 	  0b01101111, # 9
 	)
 
+	# Patterns of the digits without (0 to 9) and with (10 to 19) the decimal point
+	signedDigit = bytes(digitTable) + bytes(d | 0x80 for d in digitTable)
+
 	alphaTable = {
 	  '0' : 0b00111111,
 	  '1' : 0b00000110,
@@ -118,14 +140,28 @@ class HT16K334x7:
 	  'm' : 0b01110010	# mu
 	}
 	
+	# Patterns of the ASCII characters, indexed by character code,
+	# 0 (blank) for the characters that are not in alphaTable
+	alphaLUT = bytearray(128)
+	for c in alphaTable:
+		alphaLUT[ord(c)] = alphaTable[c]
+	del c
+	
 	hyphen = 0b01000000	 # '-'
 
-	def __init__(self, scl, sda, addr=0x70):
+	def __init__(self, scl, sda=None, addr=0x70, freq=400000):
 		"""
 		Params:
-		* scl = SCL pin for the I2C bus
+		* scl = SCL pin for the I2C bus, or an already configured machine.I2C
+		  bus when sda is None
 		* sda = SDA pin for the I2C bus
 		* addr = I2C address of the display
+		* freq = clock frequency of the I2C bus, when it is created here.
+		  400kHz is the maximum for the HT16K33 and works with the 4.7kΩ pull-ups
+		  of the Adafruit backpack. Faster buses need stronger (about 1kΩ) pull-ups.
+		The I2C commands are built in buffers that are allocated here and reused
+		by all methods, so the methods do not allocate memory but are not reentrant:
+		do not call them from an interrupt handler while another one is running.
 		"""
 		self.address = addr
 		self.isOn = HT16K334x7.dispOff
@@ -136,8 +172,17 @@ class HT16K334x7:
 		self.timer = None  # timer used to scroll long strings
 		self.data = bytearray(2) # 2-byte buffer
 		self.buf = bytearray(1)   # 1-byte buffer
+		# Start address followed by the display RAM from address 0x00 to 0x08,
+		# for writing the 4 digits and the dots in one transfer (the HT16K33
+		# increments its RAM address after each byte)
+		self._frame = bytearray(10)
 		
-		self.i2c = machine.I2C(scl = scl, sda = sda)
+		if sda is None :
+			self.i2c = scl
+		else :
+			self.i2c = machine.I2C(scl = scl, sda = sda, freq = freq)
+		self._writeto = self.i2c.writeto  # bound method, looked up only once
+		self._dispSetup = None  # last display setup command sent, None if unknown
 		
 		self.start()
 	
@@ -145,40 +190,53 @@ class HT16K334x7:
 		"""
 		Send some data to the HT16K33 controller
 		"""
-		self.i2c.writeto(self.address, data)
+		self._writeto(self.address, data)
 	
 	def sendbyte(self, b):
 		"""
 		Send a single byte to the HT16K33 controller
 		"""
-		self.buf[0] = b
-		self.i2c.writeto(self.address, self.buf)
+		buf = self.buf
+		buf[0] = b
+		self._writeto(self.address, buf)
 	
 	def start(self):
 		"""
 		Start the internal oscillator
 		"""
-		self.sendbyte(HT16K334x7.register['sysSetup'] | HT16K334x7.clockOn)
+		self.sendbyte(_REG_SYS | _CLOCK_ON)
 	
 	def stop(self):
 		"""
 		Stop the internal oscillator
 		"""
-		self.sendbyte(HT16K334x7.register['sysSetup'] | HT16K334x7.clockOff)
+		self.sendbyte(_REG_SYS | _CLOCK_OFF)
+	
+	def _sendDispSetup(self):
+		"""
+		Send the display setup command for the current on/off and blinking modes,
+		unless it is the one that was sent last.
+		Each HT16K33 command is a single byte transfer, only the display RAM
+		accepts several bytes, so the setup commands can not be merged.
+		"""
+		cmd = _REG_DSP | self.isOn | self.blinkMode
+		if cmd != self._dispSetup:
+			self.sendbyte(cmd)
+			self._dispSetup = cmd
 	
 	def on(self):
 		"""
 		Switch the display on
 		"""
 		self.isOn = HT16K334x7.dispOn
-		self.sendbyte(HT16K334x7.register['dispSetup'] | self.isOn | self.blinkMode)
+		self._sendDispSetup()
 	
 	def off(self):
 		"""
 		Switch the display off
 		"""
 		self.isOn = HT16K334x7.dispOff
-		self.sendbyte(HT16K334x7.register['dispSetup'] | self.isOn | self.blinkMode)
+		self._sendDispSetup()
 	
 	def blink(self, blinkVal):
 		"""
@@ -193,7 +251,7 @@ class HT16K334x7:
 		if not blinkVal in (HT16K334x7.blinkOff, HT16K334x7.blink2Hz, HT16K334x7.blink1Hz, HT16K334x7.blinkHalfHz):
 			blinkVal = HT16K334x7.blinkOff
 		self.blinkMode = blinkVal
-		self.sendbyte(HT16K334x7.register['dispSetup'] | self.isOn | self.blinkMode)
+		self._sendDispSetup()
 
 	def set_brightness(self, level):
 		"""
@@ -201,22 +259,16 @@ class HT16K334x7:
 		The 'level' parameter should be between 0 and 15.
 		Other values will be clipped to this range.
 		"""
-		if level < 0:
-			level = 0
-		if level > 15:
-			level = 15
-		self.sendbyte(HT16K334x7.register['dimming'] | level)
+		self.sendbyte(_REG_DIM | max(0, min(15, level)))
 
 	def setDots(self, on):
 		"""
 		Switch the o'clock dots on or off.
 		The 'on' parameter is a boolean value.
 		"""
-		self.data[0] = HT16K334x7.register['dispAddr'] | HT16K334x7.dotsAddr
-		if on:
-			self.data[1] = HT16K334x7.dotsOn
-		else:
-			self.data[1] = HT16K334x7.dotsOff
+		dots = _DOTS_ON if on else _DOTS_OFF
+		_pack_into('BB', self.data, 0, _REG_DISP | _DOTS_ADDR, dots)
+		self._frame[1 + _DOTS_ADDR] = dots
 		self.send(self.data)
 	
 	def display(self, dig_num, raw):
@@ -225,18 +277,33 @@ class HT16K334x7:
 		The 'raw' parameter is a byte whose bits correspond to segments
 		dp g f e d c b a from the most significant bit to the least significant one.
 		"""
-		self.data[0] = HT16K334x7.register['dispAddr'] | HT16K334x7.digAddr[dig_num]
-		self.data[1] = raw
+		_pack_into('BB', self.data, 0, _REG_DISP | HT16K334x7.digAddr[dig_num], raw)
+		self._frame[1 + HT16K334x7.digAddr[dig_num]] = raw
 		self.send(self.data)
 	
+	def displayRaw4(self, raw0, raw1, raw2, raw3):
+		"""
+		Display a pattern on each of the 4 digits, from left to right,
+		in a single I2C transfer. The o'clock dots are left as they are.
+		"""
+		frame = self._frame
+		frame[0] = _REG_DISP
+		frame[1] = raw0
+		frame[3] = raw1
+		frame[7] = raw2
+		frame[9] = raw3
+		self._writeto(self.address, frame)
+	
 	def clear(self):
 		"""
 		Clear the display (switch off all segment)
 		"""
 		self.stopDisplayString()
-		for dig in range(4):
-			self.display(dig, 0x00)
-		self.setDots(False)
+		frame = self._frame
+		for i in range(len(frame)):
+			frame[i] = 0
+		frame[0] = _REG_DISP
+		self.send(frame)  # digits and dots off in one transfer
 	
 	def displayDigit(self, dig_num, value):
 		"""
@@ -245,48 +312,57 @@ class HT16K334x7:
 		Digits are numbered 0 to 3 from left to right
 		"""
 		self.stopDisplayString()
-		dot = HT16K334x7.decimalPointOff
+		off = 0
 		if value < 0:
-			dot = HT16K334x7.decimalPointOn
+			off = 10
 			value = -value
 		if value > 9:
-			self.display(dig_num, hyphen | dot)
+			self.display(dig_num, HT16K334x7.hyphen | (off and _DP_ON))
 		else:
-			self.display(dig_num, HT16K334x7.digitTable[value] | dot)
+			self.display(dig_num, HT16K334x7.signedDigit[off + value])
 	
 	def displayNumber(self, value):
 		"""
-		Display a number.
-		If 'value' is negative, the decimal dots will be on.
+		Display a number on the 4 digits, with leading zeros.
+		If 'value' is negative, the decimal dots of all 4 digits will be on,
+		including those of the leading zeros: -5 is displayed as 0.0.0.5.
 		If the absolute value of 'value' is larger than 9999, hyphens will be displayed
 		"""
 		self.stopDisplayString()
-		sign = 1
-		if value < 0:
-			sign = -1
-			value = -value
+		off = 10 if value < 0 else 0  # offset of the patterns with the decimal point in signedDigit
+		value = abs(value)
 		if value > 9999:
-			for dig in range(4):
-				self.display(dig, HT16K334x7.hyphen)
+			h = HT16K334x7.hyphen
+			self.displayRaw4(h, h, h, h)
 		else:
-			for dig in range(3, -1, -1):
-				self.displayDigit(dig, sign * (value % 10))
-				value = value // 10
+			table = HT16K334x7.signedDigit
+			raw3 = table[off + value % 10]
+			value //= 10
+			raw2 = table[off + value % 10]
+			value //= 10
+			raw1 = table[off + value % 10]
+			value //= 10
+			self.displayRaw4(table[off + value], raw1, raw2, raw3)
+	
+	@staticmethod
+	def alphaPattern(char):
+		"""
+		Return the pattern of segments for character 'char', 0 (blank) if it is not in the table.
+		"""
+		c = ord(char)
+		return HT16K334x7.alphaLUT[c] if c < 128 else 0x00
 	
 	def rawDisplayAlpha(self, dig_num, char, dot=False):
 		"""
 		Display a character on digit 'dig_num'.
 		The patterns of segments for the characters are in a table.
-		If the character 'char' is not in the table, nothing will be displayed.
+		If the character 'char' is not in the table, it is displayed as a blank.
 		If 'dot' is True, the decimal point will be switched on.
 		"""
-		if not char in HT16K334x7.alphaTable:
-			self.display(dig_num, 0x00)
-		else:
-			dp = HT16K334x7.decimalPointOff
-			if dot:
-				dp = HT16K334x7.decimalPointOn
-			self.display(dig_num, HT16K334x7.alphaTable[char] | dp)
+		raw = HT16K334x7.alphaPattern(char)
+		if dot:
+			raw |= _DP_ON
+		self.display(dig_num, raw)
 	
 	def displayAlpha(self, dig_num, char, dot=False):
 		"""
@@ -300,9 +376,14 @@ class HT16K334x7:
 		"""
 		Timer interrupt handler for scrolling long strings on the display
 		"""
-		self.offset = (self.offset + 1) % self.length
-		for dig in range(4):
-			self.rawDisplayAlpha(dig, self.string[(dig + self.offset) % self.length])
+		o = self.offset + 1
+		if o >= self.length:
+			o = 0
+		self.offset = o
+		# The window of 4 characters is contiguous in the scroll buffer,
+		# send it in one I2C transfer
+		b = self._scrollBuf
+		self.displayRaw4(b[o], b[o + 1], b[o + 2], b[o + 3])
 		
 	def displayString(self, string, delay=300, timer=None):
 		"""
@@ -318,6 +399,11 @@ class HT16K334x7:
 			self.string = string + '    '
 			self.length = n + 3
 			self.offset = 0
+			# Patterns of the characters, followed by the 3 first ones again
+			# so that the window starting at any offset needs no modulo
+			self._scrollBuf = bytearray(self.length + 3)
+			for i in range(self.length + 3):
+				self._scrollBuf[i] = HT16K334x7.alphaPattern(self.string[i % self.length])
 			if timer == None :
 				timer = machine.Timer(-1)
 			self.timer = timer
@@ -326,8 +412,11 @@ class HT16K334x7:
 			  mode = machine.Timer.PERIODIC,
 			  callback = self.dispStringInterruptHandler
 			)
+		# Show the first 4 characters in one I2C transfer, blank digits on the right
+		raw = [0, 0, 0, 0]
 		for dig in range(min(n, 4)):
-			self.rawDisplayAlpha(dig, string[dig])
+			raw[dig] = HT16K334x7.alphaPattern(string[dig])
+		self.displayRaw4(raw[0], raw[1], raw[2], raw[3])
 
 	def stopDisplayString(self):
 		if self.timer != None :
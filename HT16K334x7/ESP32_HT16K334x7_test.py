@@ -58,8 +58,9 @@ def main() :
   disp.displayDigit(3,1)
   utime.sleep_ms(500)
 
+  displayNumber = disp.displayNumber  # avoid looking up the method at each iteration
   for i in range(10000):
-    disp.displayNumber(i)
+    displayNumber(i)
     utime.sleep_ms(3)
 
   disp.setDots(True)
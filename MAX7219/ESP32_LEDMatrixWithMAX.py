@@ -5,6 +5,7 @@
 # 2015-06-16
 # This software is licensed under the Eclipse Public License 2.0
 ############
+import micropython
 from ESP32_MAX7219 import MAX7219
 
 """ Test program
@@ -31,15 +32,27 @@ while True:
 """
 
 class LEDMatrixWithMAX:
-	def __init__(self, NSS, SCK, MOSI, MISO, baudrate=328125):
+	# Mask of bit y of a byte, for y from 0 to 7
+	_BITS = bytes(1 << y for y in range(8))
+	# Mask for clearing bit y of a byte
+	_INVBITS = bytes(0xFF ^ (1 << y) for y in range(8))
+	
+	def __init__(self, NSS, SCK, MOSI, MISO, baudrate=10000000):
 		"""
-		Create a new LED matrix
+		Create a new LED matrix.
+		baudrate is the SCK clock rate of the SPI bus (see MAX7219)
 		"""
 		self.max = MAX7219(NSS, SCK, MOSI, MISO, baudrate)
 		self.max.scan(8)
 		self.max.decode(MAX7219.NO_DECODE)
 		self.max.test(MAX7219.NOTEST)
 		self.bitmap = bytearray(8)
+		# Register address and data for each of the 8 digit registers (0x01 to 0x08),
+		# with one 2-byte view per register for the transfers
+		self._frame = bytearray(16)
+		for i in range(8):
+			self._frame[2*i] = 0x01 + i
+		self._regs = tuple(memoryview(self._frame)[2*i:2*i+2] for i in range(8))
 		self.clearDisplay()
 	
 	def on(self, on=True):
@@ -56,8 +69,18 @@ class LEDMatrixWithMAX:
 	
 	def updateDisplay(self):
 		""" Refresh the LEDs so that they match the pixels """
+		# Same as self.max.digit(i, self.bitmap[i]) without the method calls,
+		# the register addresses are already in the frame
+		cs = self.max.CS_pin.value
+		write = self.max.spi_bus.write
+		frame = self._frame
+		regs = self._regs
+		bitmap = self.bitmap
 		for i in range(8):
-			self.max.digit(i, self.bitmap[i])
+			frame[2*i + 1] = bitmap[i]
+			cs(0)
+			write(regs[i])
+			cs(1)
 	
 	def clearDisplay(self):
 		""" Set all pixels and LEDs off """
@@ -67,10 +90,24 @@ class LEDMatrixWithMAX:
 	def setPixel(self, x, y, on):
 		""" Switch a given pixel on or off (does not change the LED) """
 		if on:
-			self.bitmap[x] |= 2**y
+			self.bitmap[x] |= LEDMatrixWithMAX._BITS[y]
 		else:
-			self.bitmap[x] &= ~(2**y)
+			self.bitmap[x] &= LEDMatrixWithMAX._INVBITS[y]
 
+	@micropython.native
+	def _setRows(self, rows):
+		"""
+		Set the pixels from 8 row values. In each row, the most significant of
+		the 8 least significant bits is the leftmost pixel (x = 0).
+		"""
+		bitmap = self.bitmap
+		for x in range(8):
+			shift = 7 - x
+			col = 0
+			for y in range(8):
+				col |= ((rows[y] >> shift) & 1) << y
+			bitmap[x] = col
+	
 	def setIntensity(self, percent):
 		""" Set the light intensity of the LEDs """
 		self.max.intensity(percent)
@@ -92,16 +129,17 @@ class LEDMatrixWithMAX:
 		if len(image) != 8:
 			raise RuntimeError("Image does not have 8 components")
 		if isinstance(image[0], int):
-			for i in range(8):
-				value = image[i]
-				for j in range(8):
-					self.setPixel(j, i, value & 2**(7 - j))
+			self._setRows(image)
 		elif isinstance(image[0], str):
+			rows = bytearray(8)
 			for i in range(8):
 				if len(image[i]) != 8:
 					raise RuntimeError("String in image does not have 8 character")
-				for j in range(8):
-					self.setPixel(j, i, image[i][j] != ' ')
+				row = 0
+				for c in image[i]:
+					row = (row << 1) | (c != ' ')
+				rows[i] = row
+			self._setRows(rows)
 		elif isinstance(image[0], (tuple, list)):
 			for i in range(8):
 				if len(image[i]) != 8:
@@ -111,3 +149,14 @@ class LEDMatrixWithMAX:
 		else:
 			raise RuntimeError("Could not interpret image")
 		self.updateDisplay()
+	
+	def showPacked(self, packed):
+		"""
+		Display an image given as the 8 bytes of the bitmap, one per column,
+		bit y of byte x being the pixel at (x, y).
+		Such images can be computed offline with pack_image.py.
+		"""
+		if len(packed) != 8:
+			raise ValueError("Packed image does not have 8 bytes")
+		self.bitmap[:] = packed
+		self.updateDisplay()
@@ -6,6 +6,15 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
+from micropython import const
+
+# Addresses of the MAX7219 registers (see MAX7219.register)
+_REG_DIGIT0 = const(0x01)	# digit registers are 0x01 to 0x08
+_REG_DECODE = const(0x09)
+_REG_INTENSITY = const(0x0A)
+_REG_SCANLIMIT = const(0x0B)
+_REG_SHUTDOWN = const(0x0C)
+_REG_TEST = const(0x0F)
 
 class MAX7219:
 	"""
@@ -52,30 +61,32 @@ class MAX7219:
 		# 0x0F : <blank>
 		'digit'     : (0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08),
 		# Decode register. Its value sets the decode mode (NO_DECODE or CODEB)
-		'decode'    : 0x09,
+		'decode'    : _REG_DECODE,
 		# Intensity register. Set the duty cycle from 1/32 for 0x00 to 31/32 for 0x0F
-		'intensity' : 0x0A,
+		'intensity' : _REG_INTENSITY,
 		# Scan limit register. Display digit 0 only for 0x00, digits 0 to 7 for 0x07
-		'scanlimit' : 0x0B,
+		'scanlimit' : _REG_SCANLIMIT,
 		# Shutdown register. Sets the MAX7219 display on (ON) or off (OFF)
-		'shutdown'  : 0x0C,
+		'shutdown'  : _REG_SHUTDOWN,
 		# Test register. Puts the MAX7219 in test mode (DOTEST) or in normal operation (NOTEST)
-		'test'      : 0x0F
+		'test'      : _REG_TEST
 	}
 	
 	"""
 	Params:
 	* NSS (CS), SCK (CLK), MISO, MOSI (DIN) are the pins used by the SPI protocol.
-	* baudrate is the SCK clock rate
+	* baudrate is the SCK clock rate, the MAX7219 supports up to 10MHz.
+	  Lower it if the wires are long or if several MAX7219 are daisy-chained.
 	The MISO pin is not used because the MAX7219 is a pure slave, but this parameter is still required.
 	"""
-	def __init__(self, NSS, SCK, MOSI, MISO, baudrate=328125):
+	def __init__(self, NSS, SCK, MOSI, MISO, baudrate=10000000):
 		self.spi_bus = machine.SPI(baudrate=baudrate,
 		                           sck=machine.Pin(SCK),
 		                           mosi=machine.Pin(MOSI),
 		                           miso=machine.Pin(MISO))
 		self.CS_pin = machine.Pin(NSS)
 		self.CS_pin.init(mode = machine.Pin.OUT)
+		self.CS_pin.value(1)	# CS is low only while sending data
 		self.buffer = bytearray(2)
 	
 	"""
@@ -83,20 +94,23 @@ class MAX7219:
 	"""
 	def deinit(self):
 		self.spi_bus.deinit()
-		self.CS_pin.init(pyb.Pin.IN)
+		self.CS_pin.init(machine.Pin.IN)
 	
 	"""
 	Write data to a register of the MAX7219.
 	Params:
 	* register is the address of the register (1 byte)
 	* data is the data to write into the register (1 byte)
+	The MAX7219 latches the data on the rising edge of CS, so CS is pulled low
+	before the transfer and back high after it.
 	"""
 	def send(self, register, data):
-		self.buffer[0] = register
-		self.buffer[1] = data
-		self.spi_bus.write(self.buffer)
-		self.CS_pin.value(1)
+		buf = self.buffer
+		buf[0] = register
+		buf[1] = data
 		self.CS_pin.value(0)
+		self.spi_bus.write(buf)
+		self.CS_pin.value(1)
 	
 	"""
 	Set a digit of the display.
@@ -105,7 +119,7 @@ class MAX7219:
 	* value is the value writen to the digit register. It will be interpreted according to the decode mode.
 	"""
 	def digit(self, number, value):
-		self.send(MAX7219.register['digit'][number], value)
+		self.send(_REG_DIGIT0 + number, value)
 	
 	"""
 	Set the decode mode.
@@ -113,7 +127,7 @@ class MAX7219:
 	* code is either MAX7219.NO_DECODE (direct bit to segment mapping), or MAX7219.CODEB (see above)
 	"""
 	def decode(self, code):
-		self.send(MAX7219.register['decode'], code)
+		self.send(_REG_DECODE, code)
 	
 	"""
 	Set the intensity of the display.
@@ -121,7 +135,7 @@ class MAX7219:
 	* percent is the percentage of the maximum intensity. 0 will set the minimum intensity, which is 1/32 of the maximum intensity.
 	"""
 	def intensity(self, percent):
-		self.send(MAX7219.register['intensity'], int((percent * 15)/100))
+		self.send(_REG_INTENSITY, int((percent * 15)/100))
 	
 	"""
 	Set the scan limit.
@@ -129,7 +143,7 @@ class MAX7219:
 	* dig_num is the number of digit to display (1 to 8)
 	"""
 	def scan(self, dig_num):
-		self.send(MAX7219.register['scanlimit'], dig_num - 1)
+		self.send(_REG_SCANLIMIT, dig_num - 1)
 	
 	"""
 	Switch to off or on mode.
@@ -137,7 +151,7 @@ class MAX7219:
 	* mode is either MAX7219.ON or MAX7219.OFF
 	"""
 	def switch(self, mode):
-		self.send(MAX7219.register['shutdown'], mode)
+		self.send(_REG_SHUTDOWN, mode)
 	
 	"""
 	Switch to testing or normal operation mode.
@@ -146,5 +160,5 @@ class MAX7219:
 	In test mode, the MAX7219 switches on all segments of all digits at maximum intensity, regardless of the register values.
 	"""
 	def test(self, test):
-		self.send(MAX7219.register['test'], test)
+		self.send(_REG_TEST, test)
 	
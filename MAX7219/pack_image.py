@@ -0,0 +1,52 @@
+############
+# pack_image.py  a host side tool for LEDMatrixWithMAX.showPacked
+#
+# Packs an 8x8 image, in any of the forms accepted by LEDMatrixWithMAX.showImage,
+# into the 8 bytes of the LED matrix bitmap, so that the packing is done once
+# on the computer instead of on the ESP32 each time the image is shown.
+#
+# Usage: python3 pack_image.py image.txt
+# where image.txt contains 8 lines of 8 characters, spaces for off, anything else for on.
+# The output is a bytes literal to pass to showPacked() in the Micropython code.
+#
+# © Frédéric Boulanger <frederic.softdev@gmail.com>
+# This software is licensed under the Eclipse Public License 2.0
+############
+import sys
+
+def pack_image(image):
+	"""
+	Return the 8 bytes of the bitmap for 'image', which should be a list or tuple
+	of 8 integers, strings, or lists or tuples of 8 values, as for showImage.
+	"""
+	if not isinstance(image, (list, tuple)):
+		raise RuntimeError("Image is not a list")
+	if len(image) != 8:
+		raise RuntimeError("Image does not have 8 components")
+	rows = []
+	for line in image:
+		if isinstance(line, int):
+			rows.append(line & 0xFF)
+			continue
+		if len(line) != 8:
+			raise RuntimeError("Line in image does not have 8 items")
+		row = 0
+		for pixel in line:
+			on = pixel != ' ' if isinstance(pixel, str) else bool(pixel)
+			row = (row << 1) | on
+		rows.append(row)
+	# Transpose the rows into the columns of the bitmap, the most significant
+	# bit of a row is the leftmost pixel, bit y of a column is row y
+	bitmap = bytearray(8)
+	for x in range(8):
+		for y in range(8):
+			bitmap[x] |= ((rows[y] >> (7 - x)) & 1) << y
+	return bytes(bitmap)
+
+if __name__ == '__main__':
+	if len(sys.argv) != 2:
+		print("Usage: python3 pack_image.py image.txt")
+		sys.exit(1)
+	with open(sys.argv[1]) as f:
+		lines = [l.rstrip('\n').ljust(8)[:8] for l in f.readlines()[:8]]
+	print(repr(pack_image(lines)))
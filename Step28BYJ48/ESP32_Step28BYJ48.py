@@ -6,6 +6,7 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
+import micropython
 import utime
 
 class Step28BYJ48:
@@ -23,6 +24,9 @@ class Step28BYJ48:
 		0b1001,
 	])
 	
+	# Values of IN1 to IN4 for each phase
+	_phaseBits = tuple(tuple((p >> i) & 1 for i in range(4)) for p in _phases)
+	
 	# Minimum milliseconds per turn (max speed is one turn in 4.096s)
 	minMsPerTurn = 4096
 	
@@ -37,6 +41,8 @@ class Step28BYJ48:
 			machine.Pin(pin3, machine.Pin.OUT),
 			machine.Pin(pin4, machine.Pin.OUT)
 		]
+		# Bound methods for setting the pins without a loop in _onePhase
+		self._d0, self._d1, self._d2, self._d3 = (pin.value for pin in self._drive)
 		if timer == None:
 			timer = -1
 		self.msPerTurn = Step28BYJ48.minMsPerTurn  # minimum value / max speed
@@ -62,24 +68,26 @@ class Step28BYJ48:
 		"""Return the period of the phase changes to achieve the desired speed."""
 		return self.msPerTurn / (1000 * 4096)
 	
+	@micropython.native
 	def _onePhase(self):
 		"""Perform one phase change of the coils."""
 		if self._remainingPhases == 0 :
 			self._timer.deinit()
-			for i in range(4) :
-				self._drive[i].value(0)
+			self._d0(0)
+			self._d1(0)
+			self._d2(0)
+			self._d3(0)
 			if self._callback != None :
 				self._callback(self)
 				self._callback = None
 			return False
 		self._remainingPhases -= 1
-		for i in range(4) :
-			self._drive[i].value((Step28BYJ48._phases[self.phase] >> i) & 1)
-		self.phase += self.step
-		if self.phase > 7 :
-			self.phase = 0
-		if self.phase < 0 :
-			self.phase = 7
+		bits = Step28BYJ48._phaseBits[self.phase]
+		self._d0(bits[0])
+		self._d1(bits[1])
+		self._d2(bits[2])
+		self._d3(bits[3])
+		self.phase = (self.phase + self.step) & 7  # wraps around in both directions
 		return True
 	
 	def _setupSteps(self, n):
@@ -6,7 +6,7 @@
 # This software is licensed under the Eclipse Public License 2.0
 ############
 import machine
-import utime
+import micropython
 
 class TMP36:
 	"""
@@ -30,6 +30,9 @@ class TMP36:
 	refTemp = 25
 	vRef = 2000        # input scale 0 - 2.0V (calibrated on my ESP32)
 	resolution = 4095  # 12 bits
+	# Fixed point factor for converting a reading to mV with a multiplication and a shift,
+	# rounded up so that the result differs by at most 1mV from val * vRef // resolution
+	_SCALE = ((vRef << 16) + resolution - 1) // resolution
 	
 	def __init__(self, pin):
 		"""Initialize a sensor on the pin.
@@ -41,19 +44,26 @@ class TMP36:
 		self.pin.atten(machine.ADC.ATTN_6DB)    # Range is 0 - 2.00 V
 		self.pin.width(machine.ADC.WIDTH_12BIT) # Max resolution is 12 bits
 	
+	@micropython.native
 	def measure(self):
 		"""Perform one measure, the result is in tenth of °C to avoid using floats."""
-		val = self.pin.read()
-		volt = (val * TMP36.vRef) // TMP36.resolution
+		return self._toTemp(self.pin.read())
+
+	@micropython.native
+	def _toTemp(self, val):
+		"""Convert an ADC reading to tenths of °C."""
+		volt = (val * TMP36._SCALE) >> 16
 		return 10*TMP36.refTemp + (volt - TMP36.offset)
 
-	def temp(self):
-		"""Return the average of a series of measures, in tenth of °C."""
-		temp = 0
-		# Average of 10 measures
+	@micropython.viper
+	def _sum10(self, adc) -> int:
+		"""Sum 10 consecutive readings of the ADC, with machine integers."""
+		s = 0
 		for i in range(10):
-			v = self.measure()
-			temp += v
-			utime.sleep_ms(15)
-		return temp // 10
+			s += int(adc.read())
+		return s
 
+	def temp(self):
+		"""Return the average of a series of measures, in tenth of °C."""
+		# Average of 10 readings, converted once
+		return self._toTemp(self._sum10(self.pin) // 10)
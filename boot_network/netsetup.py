@@ -28,6 +28,7 @@ import network
 import usocket
 import utime
 import ujson
+import micropython
 from ntptime import settime
 from machine import Timer
 
@@ -38,22 +39,23 @@ try :
 except exception :
   knownnets = {}
 
-# Sort priorities of SSIDs
+# Sort priorities of SSIDs, and separate the networks to connect to (positive priority)
+# from the default network (negative priority)
 netprio = list(knownnets.keys())
 netprio.sort()
+pos = [k for k in netprio if k >= 0]
+neg = [k for k in netprio if k < 0]
 
 if len(netprio) > 0 :
   # Firstly, try to connect to a known WiFi network
   wlan = network.WLAN(network.STA_IF)
   wlan.active(True)
   networks = wlan.scan()
-  # Get the SSIDs of the networks
-  netnames = [n[0].decode('utf-8') for n in networks]
-  for net in netprio : # Try networks in priority order
-    if net < 0 :       # Negative priority = default network, ignore for now
-      continue
+  # Get the SSIDs of the networks, as bytes to avoid decoding them
+  netnames = {n[0] for n in networks}
+  for net in pos :     # Try networks in priority order
     ssid = knownnets[net]['ssid']
-    if ssid in netnames :
+    if ssid.encode() in netnames :
       print("Trying to connect to", ssid)
       wlan.connect(ssid, knownnets[net]['pword'])
       for _ in range(5) : # Try 5 times, waiting 1 second for the connection
@@ -68,9 +70,8 @@ if len(netprio) > 0 :
   # Secondly, if no network was found, create our own
   if not wlan.isconnected() :
     wlan.active(False)
-    for net in netprio :
-      if net >= 0 :  # Existing network to which we could not connect
-        continue
+    if neg :        # There should be only one, else the one closest to 0 is used
+      net = neg[-1]
       wlan = network.WLAN(network.AP_IF)
       wlan.active(True)
       wlan.config(essid=knownnets[net]['ssid'], password=knownnets[net]['pword'])
@@ -78,10 +79,33 @@ if len(netprio) > 0 :
 # Print our IP address and the network we are on
 print(wlan.ifconfig()[0], " on ", wlan.config('essid'))
 
+# Periods for setting the time: every hour, or sooner after a failure
+_NTP_PERIOD = 3600000
+_NTP_RETRY = 60000
+ntp_timer = None
+ntp_retry = _NTP_RETRY
+
+# Set the time from pool.ntp.org, and program the next update if ntp_timer is set.
+# After a failure, retry with a doubling delay, up to the normal period.
+def _do_ntp(_) :
+  global ntp_retry
+  try :
+    settime()
+    ntp_retry = _NTP_RETRY
+    period = _NTP_PERIOD
+  except Exception :
+    period = ntp_retry
+    ntp_retry = min(2 * ntp_retry, _NTP_PERIOD)
+  if not (ntp_timer is None) :
+    ntp_timer.init(period=period, mode=Timer.ONE_SHOT, callback=_ntp_isr)
+
+# The timer only schedules the update, which must not be performed in an interrupt handler
+def _ntp_isr(t) :
+  micropython.schedule(_do_ntp, 0)
+
 # If we can reach an NTP server, setup a timer to fix the drift of the RTC every hour
 if len(usocket.getaddrinfo('pool.ntp.org', 123)) > 0 :
   # Setup a timer to set the time from pool.ntp.org
   # May not be a good idea if you plan to use Timer(-1) for something else
   # ntp_timer = Timer(-1)
-  # ntp_timer.init(period=3600000, mode=Timer.PERIODIC, callback=lambda t:settime())
-  settime()
+  _do_ntp(0)
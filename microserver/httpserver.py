@@ -13,22 +13,64 @@
 #   - from httpserver import HttpServer
 #     srv = HttpServer()
 #     srv.start()
+#   - call srv.poll() regularly, for instance in a loop:
+#     while True :
+#       srv.poll(100)
 #   - then point a browser to the url given by start()
 #
 # © Frédéric Boulanger <frederic.softdev@gmail.com>
 # 2020-05-10 -- 2020-05-19
 # This software is licensed under the Eclipse Public License 2.0
 ############
+import sys
 import socket
 import network
+import uselect
+import uos
+import utime
+
+# Header of the responses, to be completed with the length of the content
+_HTTP_200 = "HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: keep-alive\r\n\r\n"
+# Complete 'not found' response
+_HTTP_404 = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+# Active WLAN interface, once found
+_wlan = None
+
+"""Return the active WLAN interface (access point or station), or None."""
+def _active_wlan() :
+  global _wlan
+  if _wlan is None :
+    for i in (network.AP_IF, network.STA_IF) :
+      iface = network.WLAN(i)
+      if iface.active() :
+        _wlan = iface
+        break
+  return _wlan
 
 """
-A class for making HTTP 1.0 servers.
+A class for making HTTP servers.
 The default is to serve request on port 80 from any host.
+Connections are kept alive between requests when the client allows it.
 Only GET requests are processed, and resources are looked up in the /www directory.
 The default resource is /index.html
 """
 class HttpServer :
+  # Buffer shared by all servers for copying files to the client socket
+  _buf = bytearray(1024)
+  _bufview = memoryview(_buf)
+  # Limits of the cache of responses kept in RAM
+  cacheEntries = 8      # maximum number of cached responses
+  cacheSize = 32768     # maximum total size of the cached responses, in bytes
+  # Maximum size of the header of a request, the excess is ignored
+  maxHeader = 2048
+  # Connections kept open between requests
+  maxConnections = 4    # maximum number of connections kept alive
+  keepAlive = 5000      # idle time in ms after which a connection is closed
+  # Buffer shared by all servers for receiving the header of the requests
+  _hdrbuf = bytearray(maxHeader)
+  _hdrview = memoryview(_hdrbuf)
+
   """
   Initialize a server for listening to requests on the given port,
   serving files from the given root directory, and sending default when / is requested.
@@ -38,57 +80,205 @@ class HttpServer :
     self._root = root
     self._default = default
     self._listen_sock = None
+    self._bindaddr = ("0.0.0.0", port) # Bound directly, without getaddrinfo
+    self._iface_ip = None              # IP address of the active interface, once known
+    self._poller = None
+    self._clients = {}     # Deadline of each connection that is kept alive
+    self._cache = {}       # Cache of responses: path -> header + content
+    self._cache_lru = []   # Cached paths, least recently used first
+    self._cache_used = 0   # Total size of the cached responses
 
   """Stop the server."""
   def stop(self) :
     if not (self._listen_sock is None) :
       self._listen_sock.close()
+    for client_sock in self._clients :
+      client_sock.close()
+    self._clients = {}
+    self._poller = None
   
   """Start the server. Return the URL at which it can be found."""
   def start(self) :
     self._listen_sock = socket.socket()
     self._listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    self._listen_sock.bind(socket.getaddrinfo("0.0.0.0", self._port)[0][4])
+    self._listen_sock.bind(self._bindaddr)
     self._listen_sock.listen(1)
-    # Register callback
-    self._listen_sock.setsockopt(socket.SOL_SOCKET, 20, self._process_request)
-    for i in (network.AP_IF, network.STA_IF) :
-      iface = network.WLAN(i)
-      if iface.active() :
-        return "http://%s:%d" % (iface.ifconfig()[0], self._port)
-    return ""
+    # Poll the listening socket for incoming requests
+    self._poller = uselect.poll()
+    self._poller.register(self._listen_sock, uselect.POLLIN)
+    if self._iface_ip is None :
+      iface = _active_wlan()
+      if iface is None :
+        return ""
+      self._iface_ip = iface.ifconfig()[0]
+    return "http://%s:%d" % (self._iface_ip, self._port)
+  
+  """
+  Wait at most timeout milliseconds for incoming requests and process them.
+  This should be called regularly once the server is started.
+  An error while processing a request is printed, and the connection is closed.
+  """
+  def poll(self, timeout=0) :
+    if self._poller is None :
+      return
+    for ev in self._poller.poll(timeout) :
+      sock = ev[0]
+      try :
+        if sock is self._listen_sock :
+          self._process_request(sock)
+        elif ev[1] & (uselect.POLLHUP | uselect.POLLERR) :
+          self._close(sock)          # The client closed or reset a connection that was kept alive
+        elif self._serve(sock) :     # Request on a connection that was kept alive
+          self._clients[sock] = utime.ticks_add(utime.ticks_ms(), HttpServer.keepAlive)
+        else :
+          self._close(sock)
+      except Exception as e :
+        sys.print_exception(e)
+        if not (sock is self._listen_sock) :
+          self._close(sock)
+    # Close the connections that have been idle for too long
+    if self._clients :
+      now = utime.ticks_ms()
+      for client_sock in [c for c in self._clients if utime.ticks_diff(now, self._clients[c]) >= 0] :
+        self._close(client_sock)
   
   """
   Handle a 'resource not found' error.
   rez is the path to the resource.
-  stream is the client stream.
+  stream is the client socket.
   This method may be redefined in a subclass to handle this kind of error.
   """
   def resourceNotFound(self, rez, stream) :
-    stream.write("HTTP/1.0 404 Not Found\r\n\r\n".encode())
+    stream.write(_HTTP_404)
+  
+  """
+  Private method for looking up the response for the file at path in the cache.
+  On a miss, the response is built and cached if the file is small enough.
+  Return a pair (response, size) where response is the header and the content
+  as bytes, or None if the file is too large to be cached, in which case it
+  should be streamed. size is the size of the file, it is 0 on a cache hit.
+  Raise OSError if the file cannot be read.
+  Files are not reloaded when they change, restart the server for that.
+  """
+  def _cached_response(self, path) :
+    resp = self._cache.get(path)
+    if not (resp is None) :          # Hit: mark the entry as the most recently used
+      lru = self._cache_lru
+      if lru[-1] != path :
+        lru.remove(path)
+        lru.append(path)
+      return (resp, 0)
+    size = uos.stat(path)[6]         # Raises OSError if the file does not exist
+    if size > HttpServer.cacheSize :
+      return (None, size)
+    with open(path, 'rb') as rez :
+      resp = (_HTTP_200 % size).encode() + rez.read()
+    if len(resp) > HttpServer.cacheSize :
+      return (resp, size)            # Too large with its header, send it without caching it
+    # Evict the least recently used entries to make room
+    while len(self._cache_lru) >= HttpServer.cacheEntries \
+          or self._cache_used + len(resp) > HttpServer.cacheSize :
+      old = self._cache_lru.pop(0)
+      self._cache_used -= len(self._cache.pop(old))
+    self._cache[path] = resp
+    self._cache_lru.append(path)
+    self._cache_used += len(resp)
+    return (resp, size)
+
+  """Private method for closing a connection that was kept alive."""
+  def _close(self, client_sock) :
+    if self._clients.pop(client_sock, None) is None :
+      return
+    self._poller.unregister(client_sock)
+    client_sock.close()
   
-  """Private method for handling requests."""
+  """Private method for handling new connections."""
   def _process_request(self, sock) :
     (client_sock, client_addr) = sock.accept()
-    client_stream = client_sock.makefile("rwb")
-    
-    req = client_stream.readline().decode().strip()
-    sreq = req.split()
-    while len(req) > 0 :
-      req = client_stream.readline().decode().strip()
+    try :
+      client_sock.settimeout(1) # Do not wait forever for the end of a request
+      keep = self._serve(client_sock)
+    except Exception :
+      client_sock.close()
+      raise
+    if keep and len(self._clients) < HttpServer.maxConnections :
+      # Keep the connection open and poll it for the next requests
+      self._clients[client_sock] = utime.ticks_add(utime.ticks_ms(), HttpServer.keepAlive)
+      self._poller.register(client_sock, uselect.POLLIN)
+    else :
+      client_sock.close()
+  
+  """
+  Private method for handling a request on client_sock.
+  Return True if the connection can be kept alive for other requests.
+  """
+  def _serve(self, client_sock) :
+    # Read the whole header, which ends with an empty line.
+    # recv returns what has arrived after a single read, and the loop stops at the
+    # empty line, so a client that keeps the connection open is not waited for.
+    buf = HttpServer._hdrbuf
+    mv = HttpServer._hdrview
+    n = 0
+    end = -1           # Index of the empty line that ends the header
+    try :
+      while n < len(buf) :
+        chunk = client_sock.recv(min(512, len(buf) - n))
+        if not chunk : # End of the stream
+          break
+        k = len(chunk)
+        mv[n:n + k] = chunk
+        # Look for the end of the header in the new data and the 3 bytes before it
+        start = n - 3 if n > 3 else 0
+        n += k
+        end = bytes(mv[start:n]).find(b"\r\n\r\n")
+        if end >= 0 :
+          end += start
+          break
+    except OSError :   # Timeout or connection reset
+      return False
+    if n == 0 :        # The client closed the connection
+      return False
+    hdr = bytes(mv[0:n])
+    lines = hdr.split(b"\r\n", 1)
+    # Only the request line and the Connection header are used
+    sreq = lines[0].split()
+    if len(sreq) < 3 or sreq[2] != b"HTTP/1.1" :
+      keep = False     # HTTP 1.0 or earlier, close after the response
+    elif end < 0 or end + 4 < n :
+      keep = False     # Truncated header, or other data after it, which is not read
+    else :
+      keep = hdr.lower().find(b"connection: close") < 0
     
-    if len(sreq) > 0 :
-      if sreq[0] == "GET" :
-        if sreq[1]  == '/' :
-          sreq[1] = self._default
+    if len(sreq) > 1 :
+      if sreq[0] == b"GET" :
+        if sreq[1] == b'/' :
+          name = self._default
+        else :
+          name = sreq[1].decode()
+        path = self._root + name
+        try :
+          (resp, size) = self._cached_response(path)
+          rez = None if resp is not None else open(path, 'rb')
+        except OSError :             # The file does not exist or cannot be read
+          self.resourceNotFound(name, client_sock)
+          return False
         try :
-          with open(self._root + sreq[1]) as rez :
-            client_stream.write("HTTP/1.0 200 OK\r\n\r\n".encode())
-            l = rez.readline()
-            while len(l) > 0 :
-              client_stream.write(l)
-              l = rez.readline()
-        except :
-          self.resourceNotFound(sreq[1], client_stream)
-      
-    client_stream.close()
+          if rez is None :           # Small file, send header and content at once
+            client_sock.write(resp)
+          else :                     # Large file, stream it through the shared buffer
+            with rez :
+              fbuf = HttpServer._buf
+              fview = HttpServer._bufview
+              # Send the header with the first chunk of the file in a single write
+              head = (_HTTP_200 % size).encode()
+              count = len(head)
+              fview[0:count] = head
+              count += rez.readinto(fview[count:])
+              while count :
+                client_sock.write(fview[:count])
+                count = rez.readinto(fbuf)
+        except OSError :             # The client is gone, or did not read the response in time
+          return False
+        return keep
+    # Other requests are not answered, close the connection
+    return False
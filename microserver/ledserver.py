@@ -12,11 +12,18 @@ from httpserver import HttpServer
 from wsserver import WebSocketServer
 from machine import Pin
 
+# Precomputed answers
+_UPDATE_0 = b"UPDATE 0"
+_UPDATE_1 = b"UPDATE 1"
+
 """
 A subclass of WebSocketServer that implements a protocol to control 
 the builtin LED of an ESP32
 """
 class LEDserver (WebSocketServer) :
+  # Requests are matched as bytes, without decoding them
+  wants_str = False
+  
   """
   Initialize the server to listen on port 8080 (the 80 port is used by the HTTP server)
   The default address mask allows connections from anywhere. Use 127.0.0.1 if
@@ -30,6 +37,8 @@ class LEDserver (WebSocketServer) :
     super().__init__(port, address, password)
     self._debug = debug
     self._led = Pin(ledpin, Pin.OUT)
+    # Handler of each request
+    self._dispatch = {b"LED_ON": self._on, b"LED_OFF": self._off, b"STAT": self._stat}
   
   """
   Process requests from the client:
@@ -41,20 +50,29 @@ class LEDserver (WebSocketServer) :
   def process_request(self, message) :
     if message is None :   # Close server
       return None
-    elif message == "LED_ON" :
-      self._led.on()
-      answer = "UPDATE 1"
-    elif message == "LED_OFF" :
-      self._led.off()
-      answer = "UPDATE 0"
-    elif message == "STAT" :
-      answer = "UPDATE %d" % self._led.value()
+    h = self._dispatch.get(message)
+    if h is None :
+      answer = "UNKNOWN REQUEST: " + message.decode()
     else :
-      answer = "UNKNOWN REQUEST: " + message
+      answer = h()
     if self._debug :
-      print("# " + message + " --> " + answer)
+      print("#", message, "-->", answer)
     return answer
   
+  """Handle LED_ON, return the answer to send to the client."""
+  def _on(self) :
+    self._led.on()
+    return _UPDATE_1
+  
+  """Handle LED_OFF, return the answer to send to the client."""
+  def _off(self) :
+    self._led.off()
+    return _UPDATE_0
+  
+  """Handle STAT, return the answer to send to the client."""
+  def _stat(self) :
+    return _UPDATE_1 if self._led.value() else _UPDATE_0
+  
   """
   Redefined method to install process_request as the request handler
   """
@@ -89,3 +107,6 @@ hsrv = MyHttpServer()                # Create the HTTP server on port 80
 wsrv = LEDserver(8080, debug=False)  # Create the web socket server on port 8080
 print("Point your browser at:", hsrv.start())  # Start the HTTP server
 print("Web socket URL:", wsrv.start())         # Start the web socket server
+while True :                                   # Process requests
+  hsrv.poll(20)
+  wsrv.poll(20)
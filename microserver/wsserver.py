@@ -13,8 +13,13 @@
 #     * a method to process requests from the client if the connection is accepted.
 #       This method will be called and passed the string sent by the client for each 
 #       request, or None when the client closes the connection by sending Ctrl-C (code 3).
-#       It should return a string, which is the answer to send to the client, or None
-#       when nothing is to be sent back.
+#       If the wants_str attribute of the server is False, the request is passed as
+#       bytes, which avoids decoding it.
+#       It should return a string or bytes, which is the answer to send to the client,
+#       or None when nothing is to be sent back. The answer is followed by \r\n.
+#   
+#   - start the server, then call its poll() method regularly (for instance in the
+#     main loop of the program) to accept connections and process requests.
 #   
 #   See the ledserver.py example for an example of use. You may have to edit the
 #   file to set the right pin number for the builtin LED on your board.
@@ -23,32 +28,68 @@
 # 2020-05-10 -- 2020-05-19
 # This software is licensed under the Eclipse Public License 2.0
 ############
+import sys
 import socket
 import network
+import uselect
 import uwebsocket
 import websocket_helper
 import _webrepl
 
+# Active WLAN interface, once found
+_wlan = None
+
+"""Return the active WLAN interface (access point or station), or None."""
+def _active_wlan() :
+  global _wlan
+  if _wlan is None :
+    for i in (network.AP_IF, network.STA_IF) :
+      iface = network.WLAN(i)
+      if iface.active() :
+        _wlan = iface
+        break
+  return _wlan
+
 """
 A class to read data from the very constrained web sockets used 
 by the web REPL in MicroPython.
 """
 class WSReader :
+  # Maximum length of a request line, longer requests close the connection
+  _maxline = 4096
+  _TOO_LONG = b"ERROR: REQUEST TOO LONG"
+  
   """
   Initialize a WSReader for reading on websocket ws, used by WebSocketServer src,
-  calling srv_clbck to process each line receives
+  calling srv_clbck to process each line receives.
+  sock is the socket under the websocket, which is polled by the server.
+  raw is the websocket under the web REPL stream ws, which is read directly once
+  the password has been checked.
   """
-  def __init__(self, ws, srv, srv_clbck) :
+  def __init__(self, ws, srv, srv_clbck, sock=None, raw=None) :
     self._websocket = ws
+    self._raw = ws if raw is None else raw
+    self._logged = False           # True once the web REPL has accepted the password
+    self._sock = sock
     self._server = srv
     self._srv_clbck = srv_clbck
-    self._buffer = bytearray(256)  # Buffer for storing read data
-    self._idx = 0                  # Deposit index in the buffer
+    self._buffer = bytearray()     # Buffer for storing the current line
+    self._wbuf = bytearray()       # Buffer for building the answers
+    self._decode = srv.wants_str   # Pass requests as str or as bytes to the callback
     self._last = b'0'              # Last character read (for processing \r\n)
   
-  """Write a string to the socket."""
-  def write(self, string) :
-    self._websocket.write(string.encode())
+  """Write a string or bytes to the socket."""
+  def write(self, data) :
+    if isinstance(data, str) :
+      data = data.encode()
+    self._websocket.write(data)
+  
+  """Write an answer followed by \r\n to the socket, in a single write."""
+  def _reply(self, answer) :
+    buf = self._wbuf
+    buf[:] = answer.encode() if isinstance(answer, str) else answer
+    buf.extend(b"\r\n")
+    self._websocket.write(buf)
   
   """Close the socket, call the close_handler of the web socket server."""
   def close(self) :
@@ -61,41 +102,64 @@ class WSReader :
   Ctrl-C (ascii code 03) is interpreted as "Stop the server".
   """
   def _client_cbk(self, sock) :
-    c = self._websocket.read(1)       # Web REPL web sockets can be read 1 byte at a time only
-    if (c is None) :                  # Data stolen by the web REPL stuff ?
+    if self._logged :
+      chunk = self._raw.read(256)     # Read all available data (up to 256 bytes) at once
+    else :
+      # The web REPL checks the password using only the first byte of each read,
+      # so it must be read 1 byte at a time until it lets data through.
+      chunk = self._websocket.read(1)
+      if not (chunk is None) :
+        self._logged = True
+    if (chunk is None) :              # Data stolen by the web REPL stuff ?
+      return
+    if (len(chunk) == 0) :            # End of stream
+      self.close()
       return
-    if (len(c) == 0) :                # End of stream
+    if self._last == 13 and chunk[0] == 10 : # '\n' after the '\r' that ended the previous chunk
+      chunk = chunk[1:]
+      self._last = 10
+    stop = chunk.find(b"\x03")        # Ctrl-C, the data after it is ignored
+    if stop >= 0 :
+      chunk = chunk[0:stop]
+    if len(chunk) > 0 :
+      self._last = chunk[-1]          # Memorize the last character read
+    # '\r', '\n' and '\r\n' are all EOL, split the chunk into lines
+    lines = chunk.replace(b"\r\n", b"\r").replace(b"\n", b"\r").split(b"\r")
+    buffer = self._buffer
+    buffer.extend(lines[0])           # The first line continues the current line
+    line = buffer
+    for k in range(1, len(lines)) :   # All lines but the last one are complete
+      if len(line) > WSReader._maxline :
+        self._reply(WSReader._TOO_LONG)
+        self.close()                  # The line cannot be processed, give up on this client
+        return
+      if self._decode :
+        l = line.decode()             # decode the bytes into a string
+      else :
+        l = bytes(line)
+      answer = self._srv_clbck(l)     # process the request
+      if not (answer is None) :       # if there is an answer
+        self._reply(answer)           #   send it back to the client
+      line = lines[k]
+    if not (line is buffer) :         # The last line is the start of the next one
+      self._buffer = bytearray(line)
+    if len(line) > WSReader._maxline :
+      self._reply(WSReader._TOO_LONG)
       self.close()
       return
-    if c[0] == 3 :                    # Ctrl-C
+    if stop >= 0 :                    # Ctrl-C
       answer = self._srv_clbck(None)  # Call the callback with None to indicate the end of service
       if not (answer is None) :
-        self.write(answer + "\r\n")
+        self._reply(answer)
       self.close()                    # Close the socket
-      return
-    eol = False
-    if c[0] == 10 :          # '\n': avoid counting \r\n as two EOL
-      if self._last != 13 :  # if the previous character was not '\r'
-        eol = True           #   this counts as an EOL
-    elif c[0] == 13 :        # '\r' is always an EOL
-      eol = True
-    else :                   # not an EOL --> store in buffer
-      self._buffer[self._idx] = c[0]
-      self._idx += 1
-      if self._idx == len(self._buffer) :
-        eol = True           # Buffer is full, need to empty it before EOL
-    self._last = c[0]        # Memorize this character as the last one read
-    if eol :                 # Flush buffer = process request and send back the answer
-      l = self._buffer[0:self._idx].decode() # decode the bytes into a string
-      self._idx = 0                          # reset the deposit index at the start of the buffer
-      answer = self._srv_clbck(l)            # process the request
-      if not (answer is None) :              # if there is an answer
-        self.write(answer + "\r\n")          #   send it back to the client
 
 """
 A class for simple web socket servers
 """
 class WebSocketServer :
+  # Requests are passed to the handlers as str, set to False in a subclass to get bytes
+  wants_str = True
+  
   """
   Initialize a web socket server listening on the given port to requests
   from the given mask ("0.0.0.0" accepts requests from any address), with
@@ -105,7 +169,12 @@ class WebSocketServer :
     self._port = port
     self._address = address
     self._listen_sock = None
-    self._clients = []   # list of pairs (address, websocketreader)
+    self._bindaddr = (address, port) # Bound directly, without getaddrinfo
+    self._iface_ip = None            # IP address of the active interface, once known
+    self._by_addr = {}   # WSReader of each connected client address
+    self._by_reader = {} # client address of each WSReader
+    self._poller = None  # Poll object for the listening socket and the client sockets
+    self._handlers = {}  # Handler of the events on each polled socket
     self._password = password
   
   """
@@ -114,9 +183,12 @@ class WebSocketServer :
   def stop(self) :
     if not (self._listen_sock is None) :
       self._listen_sock.close()
-    for cs in self._clients :
-      cs[1].close()
-    self._clients = []
+    for reader in list(self._by_reader) :
+      reader.close()
+    self._by_addr = {}
+    self._by_reader = {}
+    self._poller = None
+    self._handlers = {}
   
   """
   Start the server, return the URL at which it can be reached.
@@ -126,15 +198,63 @@ class WebSocketServer :
     _webrepl.password(self._password)
     self._listen_sock = socket.socket()
     self._listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    self._listen_sock.bind(socket.getaddrinfo(self._address, self._port)[0][4])
+    self._listen_sock.bind(self._bindaddr)
     self._listen_sock.listen(1)
-    # Register callback
-    self._listen_sock.setsockopt(socket.SOL_SOCKET, 20, self._accept_handler)
-    for i in (network.AP_IF, network.STA_IF) :
-      iface = network.WLAN(i)
-      if iface.active() :
-        return "ws://%s:%d" % (iface.ifconfig()[0], self._port)
-    return ""
+    # Poll the listening socket for incoming connections
+    self._poller = uselect.poll()
+    self._watch(self._listen_sock, self._accept_handler)
+    if self._iface_ip is None :
+      iface = _active_wlan()
+      if iface is None :
+        return ""
+      self._iface_ip = iface.ifconfig()[0]
+    return "ws://%s:%d" % (self._iface_ip, self._port)
+  
+  """
+  Wait at most timeout milliseconds for incoming connections and data,
+  and process them. This should be called regularly once the server is started.
+  An error while processing the data of a client is printed, and the connection
+  with that client is closed.
+  """
+  def poll(self, timeout=0) :
+    if self._poller is None :
+      return
+    for ev in self._poller.poll(timeout) :
+      sock = ev[0]
+      handler = self._handlers.get(sock)
+      if handler is None :
+        continue
+      try :
+        handler(sock)
+      except Exception as e :
+        sys.print_exception(e)
+        if not (sock is self._listen_sock) :
+          self._drop(sock)
+  
+  """Private method for closing the connection of the client on sock after an error."""
+  def _drop(self, sock) :
+    for reader in self._by_reader :
+      if reader._sock is sock :
+        break
+    else :                            # Not a client yet
+      self._unwatch(sock)
+      sock.close()
+      return
+    try :
+      reader.close()
+    except Exception :
+      self.close_handler(reader)      # The socket may already be closed
+  
+  """Private method for polling sock and calling handler when it is readable."""
+  def _watch(self, sock, handler) :
+    self._poller.register(sock, uselect.POLLIN)
+    self._handlers[sock] = handler
+  
+  """Private method for stopping polling sock."""
+  def _unwatch(self, sock) :
+    if self._handlers.pop(sock, None) is None :
+      return
+    self._poller.unregister(sock)
   
   """
   Default behavior for processing requests. It simply sends the message back to the client.
@@ -151,10 +271,9 @@ class WebSocketServer :
   and returning another request handler.
   """
   def do_accept(self, address) :
-    for cl in self._clients :
-      if cl[0] == address :  # If there is already a connection from that address
-        return None          #   reject the connection
-    return self.echo         # Else handle the connection by echoing received data
+    if address in self._by_addr :  # If there is already a connection from that address
+      return None                  #   reject the connection
+    return self.echo               # Else handle the connection by echoing received data
   
   """
   Private method for handling connections from clients
@@ -166,25 +285,30 @@ class WebSocketServer :
       client_sock.close()
       return
     # Use the web REPL socket stuff to handle the connection
-    websocket_helper.server_handshake(client_sock)
+    try :
+      websocket_helper.server_handshake(client_sock)
+    except Exception :
+      client_sock.close()
+      raise
     websock = uwebsocket.websocket(client_sock, True) # Blocking writes
     webreplsock = _webrepl._webrepl(websock)
     client_sock.setblocking(False)
-    # Create a WSReader to read characters one by one and process lines
-    websock_reader = WSReader(webreplsock, self, callback)
+    # Create a WSReader to read incoming data and process lines
+    websock_reader = WSReader(webreplsock, self, callback, client_sock, websock)
     # Update the list of connected clients
-    self._clients.append((client_addr, websock_reader))
+    self._by_addr[client_addr] = websock_reader
+    self._by_reader[websock_reader] = client_addr
     # Let the WSReader callback handle incoming data
-    client_sock.setsockopt(socket.SOL_SOCKET, 20, websock_reader._client_cbk)
+    self._watch(client_sock, websock_reader._client_cbk)
 
   """
   Get the pair (client address, WSReader) that matched wsreader, or None
   """
   def getClientFromReader(self, wsreader) :
-    for cl in self._clients :
-      if cl[1] == wsreader :
-        return cl
-    return None
+    addr = self._by_reader.get(wsreader)
+    if addr is None :
+      return None
+    return (addr, wsreader)
   
   """
   Handle closing a connection.
@@ -192,6 +316,7 @@ class WebSocketServer :
   be called to maintain the list of clients up to date.
   """
   def close_handler(self, wsreader) :
-    cl = self.getClientFromReader(wsreader)
-    if not (cl is None) :
-      self._clients.remove(cl)
+    addr = self._by_reader.pop(wsreader, None)
+    if not (addr is None) :
+      del self._by_addr[addr]
+      self._unwatch(wsreader._sock)